@@ -0,0 +1,165 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.metrics import cache_result
+from Pinecone_CRUD.SourceVersions import source_versions
+from Pinecone_CRUD.main import model as embedding_model
+
+# Opt-in: ANSWER_CACHE=1 turns the cache on
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "0") == "1"
+# Minimum cosine similarity between two queries to reuse the answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+# Answers kept per notebook, and notebooks kept in memory
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_MAX_NOTEBOOKS = int(os.getenv("ANSWER_CACHE_MAX_NOTEBOOKS", "1000"))
+
+## --------------
+## SEMANTIC ANSWER CACHE
+## --------------
+# Answers of /getAIResponse per notebook, looked up by the embedding of the query: a new query
+# close enough to one answered before gets the stored answer without running the agent.
+# Every notebook holds a matrix of normalized query embeddings, so a lookup is one matrix-vector
+# product. Entries are tied to the content version of the notebook: once any source of it is
+# upserted or deleted all of its answers are dropped. Expired entries are skipped and replaced
+# first, otherwise the least recently used answer makes room. The matrix starts small and doubles
+# up to `max_entries`, most notebooks only ever hold a handful of answers.
+INITIAL_CAPACITY = 8
+
+class _NotebookAnswers:
+    def __init__(self, version, dimensions, max_entries):
+        capacity = min(INITIAL_CAPACITY, max_entries)
+        self.version = version
+        self.max_entries = max_entries
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.answers = [None] * capacity
+        self.created = np.zeros(capacity)
+        self.used = np.zeros(capacity)
+        self.size = 0
+
+    # Slot for one more answer (size < max_entries), grows the arrays when they are full
+    def add(self):
+        if self.size == len(self.answers):
+            capacity = min(2 * len(self.answers), self.max_entries)
+            extra = capacity - self.size
+            self.vectors = np.concatenate([self.vectors, np.zeros((extra, self.vectors.shape[1]), dtype=np.float32)])
+            self.answers.extend([None] * extra)
+            self.created = np.concatenate([self.created, np.zeros(extra)])
+            self.used = np.concatenate([self.used, np.zeros(extra)])
+
+        self.size += 1
+        return self.size - 1
+
+class SemanticAnswerCache:
+    def __init__(
+            self,
+            threshold=ANSWER_CACHE_THRESHOLD,
+            ttl=ANSWER_CACHE_TTL,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            max_notebooks=ANSWER_CACHE_MAX_NOTEBOOKS
+        ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_notebooks = max_notebooks
+
+        self._lock = threading.Lock()
+        self._notebooks = OrderedDict()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _entries(self, notebookID, version):
+        entries = self._notebooks.get(notebookID)
+        if entries is not None and entries.version != version:
+            # Sources changed since these answers were cached
+            del self._notebooks[notebookID]
+            entries = None
+        if entries is not None:
+            self._notebooks.move_to_end(notebookID)
+        return entries
+
+    def lookup(self, notebookID, embedding, version):
+        """Cached answer of the closest earlier query, None below the threshold."""
+        query = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            entries = self._entries(notebookID, version)
+            if entries is None or not entries.size:
+                return None
+
+            scores = entries.vectors[:entries.size] @ query
+            scores[now - entries.created[:entries.size] > self.ttl] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            entries.used[best] = now
+            return entries.answers[best]
+
+    def store(self, notebookID, embedding, version, answer):
+        query = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            entries = self._entries(notebookID, version)
+            if entries is None:
+                entries = _NotebookAnswers(version, len(query), self.max_entries)
+                self._notebooks[notebookID] = entries
+                while len(self._notebooks) > self.max_notebooks:
+                    self._notebooks.popitem(last=False)
+
+            scores = entries.vectors[:entries.size] @ query
+            if entries.size and scores.max() >= self.threshold:
+                # Same question again (e.g. a bypassed lookup): replace its answer
+                slot = int(np.argmax(scores))
+            elif entries.size < self.max_entries:
+                slot = entries.add()
+            else:
+                expired = now - entries.created > self.ttl
+                slot = int(np.argmax(expired)) if expired.any() else int(np.argmin(entries.used))
+
+            entries.vectors[slot] = query
+            entries.answers[slot] = answer
+            entries.created[slot] = now
+            entries.used[slot] = now
+
+    def clear(self):
+        with self._lock:
+            self._notebooks.clear()
+
+answer_cache = SemanticAnswerCache()
+
+def _notebook_version(notebookID):
+    return source_versions.get_many(notebookID, [('notebook', notebookID)])[('notebook', notebookID)]
+
+async def cached_answer(notebookID, query, respond, bypass=False):
+    """
+    Answer `query` from the cache of the notebook, or await `respond()` for the answer and
+    cache it. With `bypass` the lookup is skipped but the fresh answer still replaces the cache.
+    """
+    if not ANSWER_CACHE:
+        return await respond()
+
+    version = _notebook_version(notebookID)
+    embedding = await embedding_model.aembed_query(query)
+
+    if not bypass:
+        answer = answer_cache.lookup(notebookID, embedding, version)
+        cache_result("answer", answer is not None)
+        if answer is not None:
+            return answer
+
+    answer = await respond()
+    # Not cached when a source changed while the agent was answering
+    if answer and _notebook_version(notebookID) == version:
+        answer_cache.store(notebookID, embedding, version, answer)
+    return answer
@@ -1,12 +1,12 @@
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 from langgraph.prebuilt import ToolNode
-
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from langgraph.errors import GraphRecursionError
 
 # All Workflows
 from workflows.chat_workflow import get_workflow
@@ -14,24 +14,32 @@ from workflows.chat_workflow import get_workflow
 # All States
 from schema.States.chat_state import ChatState
 
+from utils.log import get_logger
+from utils.metrics import metrics_callback, stage_seconds
+from utils.clients import chat_openai
+from utils.providers import provider
+from Chat.tools import run_tool_call
+
 load_dotenv()
 
-model = ChatOpenAI(
-    model='gpt-5-nano'
-)
+logger = get_logger(__name__)
 
 # Call all the servers. For now we have only one MCP server which is velox_mcp_server
-client = MultiServerMCPClient(
-    {
-        "velox_mcp_server": {
-            "url": "https://veloxai.fastmcp.app/mcp",
-            "transport": "streamable_http",
-            "headers": {
-                "Authorization": f"Bearer {os.getenv('HORIZON_ACCESS_TOKEN')}"
+@provider("mcp_client")
+def client():
+    from langchain_mcp_adapters.client import MultiServerMCPClient
+
+    return MultiServerMCPClient(
+        {
+            "velox_mcp_server": {
+                "url": "https://veloxai.fastmcp.app/mcp",
+                "transport": "streamable_http",
+                "headers": {
+                    "Authorization": f"Bearer {os.getenv('HORIZON_ACCESS_TOKEN')}"
+                }
             }
         }
-    }
-)
+    )
 
 template = """
 You are an AI assistant.
@@ -92,42 +100,83 @@ User Notebook ID - {notebookID}
 User's query:
 {query}
 """
-    
-async def getChatResponse(
-        query: str, 
-        past_conversation: str,
-        userID: str,
-        notebookID: str
-    ):
-    # Fetch all the tools from recome MCP server
-    tools = await client.get_tools()
 
-    # Build a tool node
-    tool_node = ToolNode(tools)
+# How often (seconds) the MCP server's tool list is checked for changes
+MCP_TOOLS_REFRESH_SECONDS = int(os.getenv("MCP_TOOLS_REFRESH_SECONDS", "300"))
+
+# Agent -> tools rounds per question, and seconds after which no new tool round is started.
+# Past either budget the model has to answer with the tool results it already has.
+CHAT_MAX_TOOL_ROUNDS = int(os.getenv("CHAT_MAX_TOOL_ROUNDS", "4"))
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "60"))
+# Graph steps (LangGraph recursion limit), a safety net behind the budgets above
+CHAT_RECURSION_LIMIT = int(os.getenv("CHAT_RECURSION_LIMIT", str(2 * CHAT_MAX_TOOL_ROUNDS + 4)))
+
+BUDGET_NOTE = "No more tools can be used for this question. Answer now with the tool results above and briefly say what is missing, if anything."
+BUDGET_EXHAUSTED_ANSWER = "Sorry, I could not finish answering this question in time. Please try again or ask a narrower question."
+
+# Prompt Template
+prompt = PromptTemplate(
+    template=template,
+    input_variables=[
+        'previous_conversation', 
+        'query', 
+        'UserID', 
+        'notebookID'
+    ]
+)
+
+## --------------
+## SHARED CHAT AGENT
+## --------------
+# The tool list, the model bound to it and the compiled workflow are built once and shared by
+# every request. Everything request specific travels through ChatState.
+_agent = None
+_agent_lock = asyncio.Lock()
+_refresh_task = None
+
+# Tools are compared by name, description and argument schema to detect changes on the MCP server
+def _tools_signature(tools):
+    return sorted(
+        (tool.name, tool.description or "", str(tool.args))
+        for tool in tools
+    )
+
+# The question of this turn followed by the results of the tools called for it so far, and the
+# number of tool rounds already done
+def _agent_input(messages):
+    start = max(i for i, message in enumerate(messages) if isinstance(message, HumanMessage))
+    turn = messages[start + 1:]
+
+    query = messages[start].text
+    results = [message.text for message in turn if isinstance(message, ToolMessage)]
+    if results:
+        query += "\n\nTool results:\n" + "\n\n".join(results)
+
+    rounds = sum(1 for message in turn if isinstance(message, AIMessage) and message.tool_calls)
+    return query, rounds
+
+def _build_agent(tools):
+    # Build a tool node (calls of one turn run concurrently, each with a deadline and maybe cached)
+    tool_node = ToolNode(tools, awrap_tool_call=run_tool_call)
+
+    # Bind LLM with tools and define chain
+    chain = prompt | chat_openai().bind_tools(tools)
+    # Used once a budget ran out
+    final_chain = prompt | chat_openai()
 
     # Define agent node
     async def agent_node(state: ChatState):
-        # Bind LLM with tools
-        model_with_tools = model.bind_tools(tools)
-
-        # Prompt Template
-        prompt = PromptTemplate(
-            template=template,
-            input_variables=[
-                'previous_conversation', 
-                'query', 
-                'UserID', 
-                'notebookID'
-            ]
-        )
+        query, rounds = _agent_input(state["messages"])
 
-        # Define chain
-        chain = prompt | model_with_tools
+        exhausted = rounds >= CHAT_MAX_TOOL_ROUNDS or time.time() - state["startedAt"] > CHAT_DEADLINE_SECONDS
+        if exhausted:
+            logger.info("Chat tool budget exhausted", extra={"fields": {"rounds": rounds}})
+            query += "\n\n" + BUDGET_NOTE
 
         # Invoke model bined with tools
-        response = await chain.ainvoke({
+        response = await (final_chain if exhausted else chain).ainvoke({
             "previous_conversation": state["pastConversations"],
-            "query": state["messages"][-1].content,  # always pass string
+            "query": query,  # always pass string
             "UserID": state["UserID"],
             "notebookID": state["notebookID"]
         })
@@ -136,23 +185,165 @@ async def getChatResponse(
         return {
             "messages": [response]
         }
-    
+
     # Define workflow
     workflow = get_workflow(
         tool_node=tool_node,
         agent_node=agent_node
     )
 
-    # Define initial state
-    initial_state = {
+    return {
+        "signature": _tools_signature(tools),
+        "workflow": workflow
+    }
+
+# Fetch all the tools from remote MCP server and (re)build the agent when they changed
+async def refresh_chat_agent():
+    global _agent
+    async with _agent_lock:
+        started = time.perf_counter()
+        tools = await client().get_tools()
+        fetched = time.perf_counter()
+
+        if _agent is not None and _agent["signature"] == _tools_signature(tools):
+            return _agent
+
+        _agent = _build_agent(tools)
+        stage_seconds.observe(fetched - started, stage="mcp_get_tools")
+        logger.info("Chat agent built", extra={"fields": {
+            "tools": len(tools),
+            "get_tools_ms": round((fetched - started) * 1000, 1),
+            "build_ms": round((time.perf_counter() - fetched) * 1000, 1)
+        }})
+        return _agent
+
+async def get_chat_agent():
+    if _agent is None:
+        return await refresh_chat_agent()
+    return _agent
+
+async def _refresh_loop():
+    while True:
+        await asyncio.sleep(MCP_TOOLS_REFRESH_SECONDS)
+        try:
+            await refresh_chat_agent()
+        except Exception as e:
+            logger.exception("Failed to refresh MCP tools")
+
+# Called from the FastAPI lifespan: build the agent once and keep it fresh in the background.
+async def start_chat_agent():
+    global _refresh_task
+    try:
+        await refresh_chat_agent()
+    except Exception as e:
+        # The first request will try again
+        logger.exception("Failed to build chat agent at startup")
+
+    _refresh_task = asyncio.create_task(_refresh_loop())
+
+async def stop_chat_agent():
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+
+# Define initial state
+def _initial_state(query, past_conversation, userID, notebookID):
+    return {
         "messages": [HumanMessage(content=query)],
         "pastConversations": past_conversation,
         "UserID": userID,
-        "notebookID": notebookID
+        "notebookID": notebookID,
+        "startedAt": time.time()
     }
 
-    response = await workflow.ainvoke(
-        initial_state
-    )
+def _config():
+    return {"callbacks": [metrics_callback], "recursion_limit": CHAT_RECURSION_LIMIT}
+
+async def getChatResponse(
+        query: str, 
+        past_conversation: str,
+        userID: str,
+        notebookID: str
+    ):
+    agent = await get_chat_agent()
+
+    try:
+        response = await agent["workflow"].ainvoke(
+            _initial_state(query, past_conversation, userID, notebookID),
+            config=_config()
+        )
+    except GraphRecursionError:
+        logger.warning("Chat recursion limit reached")
+        return {"messages": [AIMessage(content=BUDGET_EXHAUSTED_ANSWER)]}
+
+    return response
 
-    return response
\ No newline at end of file
+## --------------
+## STREAMING
+## --------------
+async def streamChatResponse(
+        query: str, 
+        past_conversation: str,
+        userID: str,
+        notebookID: str
+    ):
+    """
+    Same workflow as getChatResponse but yields events while it runs:
+        - tool_start / tool_end: progress of tool calls
+        - token: a piece of the answer as the model generates it
+        - done: the final answer with time to first token and total time (ms)
+
+    Cancelling the consumer (e.g. client disconnect) cancels in-flight model and tool calls.
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    answer = ""
+
+    agent = await get_chat_agent()
+
+    try:
+        async for event in agent["workflow"].astream_events(
+            _initial_state(query, past_conversation, userID, notebookID),
+            config=_config(),
+            version="v2"
+        ):
+            kind = event["event"]
+
+            if kind == "on_tool_start":
+                yield {"event": "tool_start", "data": {"tool": event["name"]}}
+
+            elif kind == "on_tool_end":
+                yield {"event": "tool_end", "data": {"tool": event["name"]}}
+
+            elif kind == "on_chat_model_start":
+                # A new model turn, only the last one is the final answer
+                answer = ""
+
+            elif kind == "on_chat_model_stream":
+                token = event["data"]["chunk"].content
+                if isinstance(token, str) and token:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    answer += token
+                    yield {"event": "token", "data": {"token": token}}
+    except GraphRecursionError:
+        logger.warning("Chat recursion limit reached")
+        if not answer:
+            answer = BUDGET_EXHAUSTED_ANSWER
+            yield {"event": "token", "data": {"token": answer}}
+
+    finished = time.perf_counter()
+    ttft_ms = round((first_token_at - started) * 1000, 1) if first_token_at else None
+    total_ms = round((finished - started) * 1000, 1)
+    stage_seconds.observe(finished - started, stage="chat_stream")
+    if first_token_at:
+        stage_seconds.observe(first_token_at - started, stage="chat_ttft")
+    logger.info("Streamed chat response", extra={"fields": {"ttft_ms": ttft_ms, "total_ms": total_ms}})
+
+    yield {
+        "event": "done",
+        "data": {
+            "response": answer,
+            "ttft_ms": ttft_ms,
+            "total_ms": total_ms
+        }
+    }
@@ -0,0 +1,229 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+
+from langchain_core.prompts import PromptTemplate
+
+from utils.log import get_logger
+from utils.metrics import timed
+from utils.blocking import run_blocking
+from utils.singleflight import SingleFlight
+from Pinecone_CRUD.Chunker import count_tokens
+from utils.clients import chat_openai
+
+logger = get_logger(__name__)
+
+# Tokens of history put into the chat prompt (summary plus recent messages)
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "2000"))
+# Size the running summary is asked to stay under
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "400"))
+# Messages that are never folded into the summary
+CHAT_RECENT_MESSAGES = int(os.getenv("CHAT_RECENT_MESSAGES", "4"))
+
+## --------------
+## CONVERSATION STORE
+## --------------
+# Messages and the running summary of every conversation, keyed by (userID, notebookID), so the
+# client only sends the new question. Older messages are removed once they are in the summary.
+class ConversationMemory:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                notebook_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE INDEX IF NOT EXISTS conversation_messages_by_conversation
+            ON conversation_messages (user_id, notebook_id, id)
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id TEXT NOT NULL,
+                notebook_id TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, notebook_id)
+            )
+        """)
+        self._db.commit()
+
+    # messages: list of (role, content)
+    def append(self, userID, notebookID, messages):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO conversation_messages (user_id, notebook_id, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(userID, notebookID, role, content, count_tokens(content), now) for role, content in messages]
+            )
+            self._db.commit()
+
+    # (summary, summary tokens, [(id, role, content, tokens)] oldest first)
+    def load(self, userID, notebookID):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary, tokens FROM conversation_summaries WHERE user_id = ? AND notebook_id = ?",
+                (userID, notebookID)
+            ).fetchone()
+            messages = self._db.execute(
+                "SELECT id, role, content, tokens FROM conversation_messages WHERE user_id = ? AND notebook_id = ? ORDER BY id",
+                (userID, notebookID)
+            ).fetchall()
+        summary, tokens = row if row else ("", 0)
+        return summary, tokens, messages
+
+    # Replace the summary with one that covers every message up to `upto_id` and drop those.
+    # Returns False without writing when those messages are already gone (the conversation was
+    # cleared or folded while the summary was being written). Ids are never reused, so nothing
+    # newer can match.
+    def fold(self, userID, notebookID, upto_id, summary):
+        with self._lock:
+            folded = self._db.execute(
+                "DELETE FROM conversation_messages WHERE user_id = ? AND notebook_id = ? AND id <= ?",
+                (userID, notebookID, upto_id)
+            ).rowcount
+            if not folded:
+                self._db.rollback()
+                return False
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversation_summaries (user_id, notebook_id, summary, tokens, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (userID, notebookID, summary, count_tokens(summary), time.time())
+            )
+            self._db.commit()
+        return True
+
+    def clear(self, userID, notebookID):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM conversation_messages WHERE user_id = ? AND notebook_id = ?",
+                (userID, notebookID)
+            )
+            self._db.execute(
+                "DELETE FROM conversation_summaries WHERE user_id = ? AND notebook_id = ?",
+                (userID, notebookID)
+            )
+            self._db.commit()
+
+conversation_memory = ConversationMemory(
+    os.getenv("CHAT_MEMORY_PATH", ".cache/conversations.sqlite3")
+)
+
+## --------------
+## HISTORY COMPACTION
+## --------------
+# The prompt gets the summary plus the newest messages that fit in CHAT_HISTORY_TOKENS. When the
+# stored history outgrows the budget, the oldest messages (all but CHAT_RECENT_MESSAGES and until
+# the rest fits in half the budget) are merged into the summary in the background, one LLM call
+# per compaction, so the summary is maintained incrementally and never rebuilt from scratch.
+summary_template = """
+Below is the running summary of a conversation between a user and an AI assistant about the user's notebook, followed by newer messages of that conversation.
+
+Write an updated summary that covers both. Keep the facts, names, numbers, decisions and open questions the user may refer back to. Do not exceed {words} words.
+
+Current summary:
+{summary}
+
+Newer messages:
+{messages}
+
+Updated summary:
+"""
+
+summary_prompt = PromptTemplate(
+    template=summary_template,
+    input_variables=['summary', 'messages', 'words']
+)
+
+_compactions = SingleFlight()
+
+# Keep references to background compactions so they are not garbage collected
+_background_tasks = set()
+
+def _format(messages):
+    return "\n".join(
+        f"{'User' if role == 'user' else 'Assistant'}: {content}"
+        for _, role, content, _ in messages
+    )
+
+async def history(userID, notebookID, budget=CHAT_HISTORY_TOKENS):
+    """Stored conversation as prompt text: the summary and the newest messages within `budget` tokens."""
+    if not userID or not notebookID:
+        return ""
+
+    # sqlite and token counting run on the blocking pool, never on the event loop
+    summary, used, messages = await run_blocking(conversation_memory.load, userID, notebookID)
+
+    # Newest first until the budget is spent, the last exchange always goes in
+    recent = []
+    for message in reversed(messages):
+        if len(recent) >= 2 and used + message[3] > budget:
+            break
+        recent.insert(0, message)
+        used += message[3]
+
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    if recent:
+        parts.append(_format(recent))
+    return "\n\n".join(parts)
+
+async def compact(userID, notebookID, budget=CHAT_HISTORY_TOKENS):
+    summary, summary_tokens, messages = await run_blocking(conversation_memory.load, userID, notebookID)
+    if summary_tokens + sum(message[3] for message in messages) <= budget:
+        return
+
+    # Oldest messages go until the kept ones fit in half the budget
+    old = list(messages[:-CHAT_RECENT_MESSAGES]) if CHAT_RECENT_MESSAGES else list(messages)
+    kept = sum(message[3] for message in messages) - sum(message[3] for message in old)
+    while old and kept + old[-1][3] <= budget // 2:
+        kept += old.pop()[3]
+    if not old:
+        return
+
+    with timed("chat_compaction"):
+        response = await (summary_prompt | chat_openai()).ainvoke({
+            "summary": summary or "(none yet)",
+            "messages": _format(old),
+            "words": CHAT_SUMMARY_TOKENS * 3 // 4
+        })
+
+    if not await run_blocking(conversation_memory.fold, userID, notebookID, old[-1][0], response.content):
+        logger.info("Dropped compaction of a cleared conversation")
+        return
+    logger.info("Compacted conversation", extra={"fields": {"messages": len(old), "kept_tokens": kept}})
+
+async def _compact_in_background(userID, notebookID):
+    try:
+        await _compactions.do(f"{userID}:{notebookID}", lambda: compact(userID, notebookID))
+    except Exception as e:
+        # Nothing is lost, the next turn tries again
+        logger.exception("Failed to compact conversation")
+
+async def remember(userID, notebookID, query, answer):
+    """Store one exchange, compacting the conversation in the background when it outgrew the budget."""
+    if not userID or not notebookID:
+        return
+
+    await run_blocking(conversation_memory.append, userID, notebookID, [("user", query), ("assistant", answer)])
+
+    if not _compactions.running(f"{userID}:{notebookID}"):
+        task = asyncio.create_task(_compact_in_background(userID, notebookID))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
@@ -0,0 +1,91 @@
+import os
+import json
+import asyncio
+import hashlib
+
+from langchain_core.messages import ToolMessage
+
+from utils.disk_cache import DiskCache
+from utils.singleflight import SingleFlight
+from utils.log import get_logger
+from utils.metrics import cache_result
+from utils.blocking import run_blocking
+from Pinecone_CRUD.SourceVersions import source_versions
+
+logger = get_logger(__name__)
+
+# Seconds a tool call may take, per tool overrides as "name=seconds,name=seconds"
+CHAT_TOOL_TIMEOUT_SECONDS = float(os.getenv("CHAT_TOOL_TIMEOUT_SECONDS", "20"))
+CHAT_TOOL_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, seconds in (
+        item.split("=") for item in os.getenv("CHAT_TOOL_TIMEOUTS", "").split(",") if "=" in item
+    )
+}
+# Idempotent retrieval tools whose results are cached, and for how long (seconds)
+CHAT_CACHED_TOOLS = {name.strip() for name in os.getenv("CHAT_CACHED_TOOLS", "retrieve_context").split(",") if name.strip()}
+CHAT_TOOL_CACHE_TTL = int(os.getenv("CHAT_TOOL_CACHE_TTL", "300"))
+
+## --------------
+## TOOL CALLS
+## --------------
+# Every tool call of the chat agent goes through `run_tool_call` (a ToolNode interceptor, so the
+# calls of one model turn still run concurrently). A call that misses its deadline is cancelled
+# and the model gets told so instead of the result. Results of the cached tools are kept per
+# (tool, arguments, notebookID, notebook content version) for a few minutes, and identical calls
+# in flight at the same time share one execution.
+tool_cache = DiskCache(
+    path=os.getenv("CHAT_TOOL_CACHE_PATH", ".cache/tools.sqlite3"),
+    table="tool_results",
+    ttl=CHAT_TOOL_CACHE_TTL,
+    max_entries=int(os.getenv("CHAT_TOOL_CACHE_MAX_ENTRIES", "5000"))
+)
+
+_calls = SingleFlight()
+
+def _tool_key(name, args, notebookID):
+    version = source_versions.get_many(notebookID, [('notebook', notebookID)])[('notebook', notebookID)]
+    return hashlib.sha256(
+        json.dumps([name, args, notebookID, version], sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+async def _execute(request, execute, timeout):
+    name = request.tool_call["name"]
+    try:
+        return await asyncio.wait_for(execute(request), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Tool call timed out", extra={"fields": {"tool": name, "timeout": timeout}})
+        return ToolMessage(
+            content=f"The {name} tool did not answer within {timeout:g} seconds. Answer with the information you already have.",
+            tool_call_id=request.tool_call["id"],
+            name=name,
+            status="error"
+        )
+
+async def run_tool_call(request, execute):
+    call = request.tool_call
+    name = call["name"]
+    timeout = CHAT_TOOL_TIMEOUTS.get(name, CHAT_TOOL_TIMEOUT_SECONDS)
+
+    if name not in CHAT_CACHED_TOOLS:
+        return await _execute(request, execute, timeout)
+
+    # The version lookup and the cache are sqlite, kept off the event loop
+    key = await run_blocking(_tool_key, name, call["args"], request.state.get("notebookID", ""))
+    cached = await run_blocking(tool_cache.get, key)
+    cache_result("tool", cached is not None)
+    if cached is not None:
+        return ToolMessage(content=cached, tool_call_id=call["id"], name=name)
+
+    async def run():
+        message = await _execute(request, execute, timeout)
+        if isinstance(message, ToolMessage) and message.status != "error":
+            await run_blocking(tool_cache.set, key, message.content)
+        return message
+
+    message = await _calls.do(key, run)
+    if not isinstance(message, ToolMessage):
+        return message
+
+    # A shared result carries the id of the call that ran it
+    return ToolMessage(content=message.content, tool_call_id=call["id"], name=name, status=message.status)
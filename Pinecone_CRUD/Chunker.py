@@ -0,0 +1,110 @@
+import os
+import re
+import zlib
+import tiktoken
+
+# Chunk size and overlap in tokens of the embedding model
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "30"))
+# Tokenizer of text-embedding-3-small
+EMBEDDING_ENCODING = os.getenv("EMBEDDING_ENCODING", "cl100k_base")
+
+## --------------
+## TOKEN AWARE CHUNKING
+## --------------
+# Shared by url and document ingestion. Texts are cut into paragraphs, paragraphs that are too
+# long into sentences and sentences that are still too long into token windows. The pieces are
+# then packed into chunks of at most `chunk_tokens` tokens. Everything is a generator, so chunks
+# flow into the embedding batches while the rest of the page is still being split.
+#
+# Once a chunk is a quarter full it is also closed before any piece whose hash hits 1 in
+# CUT_EVERY_PIECES. These cut points only depend on the text around them, so after an edit the
+# chunk boundaries fall back in line a few pieces later and re-ingesting the page (ids are
+# content hashes) only embeds the chunks around the edit.
+CUT_EVERY_PIECES = 4
+
+_PARAGRAPHS = re.compile(r"\S.*?(?:\n\s*\n|\Z)", re.S)
+_SENTENCES = re.compile(r"\S.*?(?:[.!?]+\s+|\Z)", re.S)
+
+_encoding = None
+
+# Loaded on first use (tiktoken may have to download the vocabulary)
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(EMBEDDING_ENCODING)
+    return _encoding
+
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+# (piece, tokens) pieces of one text, none longer than max_tokens. Token windows of an overlong
+# sentence overlap each other by `overlap` tokens.
+def _pieces(text, max_tokens, overlap):
+    encoding = get_encoding()
+    for paragraph in _PARAGRAPHS.finditer(text):
+        paragraph = paragraph.group()
+        tokens = count_tokens(paragraph)
+        if tokens <= max_tokens:
+            yield paragraph, tokens
+            continue
+
+        for sentence in _SENTENCES.finditer(paragraph):
+            sentence = sentence.group()
+            tokens = count_tokens(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens
+                continue
+
+            ids = encoding.encode(sentence, disallowed_special=())
+            step = max(1, max_tokens - overlap)
+            for start in range(0, len(ids), step):
+                window = ids[start:start + max_tokens]
+                yield encoding.decode(window), len(window)
+                if start + max_tokens >= len(ids):
+                    break
+
+def _join(pieces):
+    return "".join(piece for piece, _ in pieces).strip()
+
+def chunk_texts(texts, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Yield chunks of at most `chunk_tokens` tokens from an iterable of texts (pages, or the parts
+    of a document sent by the client). Consecutive chunks share up to `overlap` tokens of whole
+    pieces at their boundary.
+    """
+    current, size = [], 0
+    for text in texts:
+        if not text:
+            continue
+
+        # Keep texts apart when a chunk spans two of them
+        if current and not current[-1][0][-1].isspace():
+            current[-1] = (current[-1][0] + "\n\n", current[-1][1])
+
+        for piece, tokens in _pieces(text, chunk_tokens, overlap):
+            full = size + tokens > chunk_tokens
+            cut = size >= chunk_tokens // 4 and zlib.crc32(piece.encode("utf-8")) % CUT_EVERY_PIECES == 0
+            if current and (full or cut):
+                yield _join(current)
+
+                # Carry the trailing pieces that fit in the overlap into the next chunk
+                tail, tail_size = [], 0
+                for previous, previous_tokens in reversed(current):
+                    if tail_size + previous_tokens > overlap:
+                        break
+                    tail.insert(0, (previous, previous_tokens))
+                    tail_size += previous_tokens
+
+                # ... as long as the new piece still fits next to them
+                while tail and tail_size + tokens > chunk_tokens:
+                    tail_size -= tail.pop(0)[1]
+                current, size = tail, tail_size
+
+            current.append((piece, tokens))
+            size += tokens
+
+    if current:
+        chunk = _join(current)
+        if chunk:
+            yield chunk
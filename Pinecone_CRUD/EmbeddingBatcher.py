@@ -0,0 +1,150 @@
+import os
+import asyncio
+
+from utils.metrics import histogram
+from utils.limits import Overloaded
+
+# EMBEDDING_BATCHING=0 sends every call straight to the model
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "1") != "0"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+# Estimated tokens per merged request (the embeddings API takes up to 300k per request)
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "64000"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+EMBEDDING_BATCH_IN_FLIGHT = int(os.getenv("EMBEDDING_BATCH_IN_FLIGHT", "4"))
+
+batch_sizes = histogram(
+    "embedding_batch_size",
+    "Texts per upstream embedding request sent by the micro-batcher",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+)
+
+## --------------
+## EMBEDDING MICRO-BATCHER
+## --------------
+# Sits in front of the embedding model and merges the texts of concurrent callers (queries,
+# small uploads, quiz dedup) into one upstream request. Texts are collected until `max_batch_size`
+# of them or `max_batch_tokens` tokens are waiting or `max_wait_ms` passed since the first one,
+# then sent together and the vectors are handed back to each caller. At most `max_in_flight`
+# requests run at once, further batches wait for a free slot. A merged request that is rejected
+# (e.g. one caller's text is too long) is sent again per caller, so only that caller fails.
+# Same async interface as the wrapped embeddings.
+class EmbeddingBatcher:
+    def __init__(
+            self,
+            embeddings,
+            max_batch_size=EMBEDDING_BATCH_SIZE,
+            max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+            max_in_flight=EMBEDDING_BATCH_IN_FLIGHT,
+            max_batch_tokens=EMBEDDING_BATCH_TOKENS
+        ):
+        self.embeddings = embeddings
+        self.model = embeddings.model
+        self.dimensions = getattr(embeddings, "dimensions", None)
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        self.max_in_flight = max_in_flight
+
+        # (text, tokens, caller, future) waiting for a batch, caller tells whose text it is
+        self._pending = []
+        self._pending_tokens = 0
+        self._callers = 0
+        self._timer = None
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Cut by count and tokens, a single text over the token cap goes alone
+        batches, batch, tokens = [], [], 0
+        for entry in self._pending:
+            if batch and (len(batch) >= self.max_batch_size or tokens + entry[1] > self.max_batch_tokens):
+                batches.append(batch)
+                batch, tokens = [], 0
+            batch.append(entry)
+            tokens += entry[1]
+        if batch:
+            batches.append(batch)
+        self._pending, self._pending_tokens = [], 0
+
+        for batch in batches:
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed(self, batch):
+        vectors = await self.embeddings.aembed_documents([text for text, _, _, _ in batch])
+        for (_, _, _, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def _fail(self, batch, error):
+        for _, _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _embed_or_fail(self, batch):
+        try:
+            await self._embed(batch)
+        except Exception as e:
+            self._fail(batch, e)
+
+    async def _send(self, batch):
+        async with self._slots:
+            # Callers that gave up while the batch waited for a slot
+            batch = [entry for entry in batch if not entry[3].done()]
+            if not batch:
+                return
+
+            batch_sizes.observe(len(batch))
+            callers = {}
+            for entry in batch:
+                callers.setdefault(entry[2], []).append(entry)
+
+            try:
+                await self._embed(batch)
+            except Exception as e:
+                # Throttling was already retried by the client, splitting it would only add load
+                if len(callers) == 1 or isinstance(e, Overloaded):
+                    self._fail(batch, e)
+                    return
+                # One caller's bad input must not fail the others
+                await asyncio.gather(*[self._embed_or_fail(entries) for entries in callers.values()])
+
+    async def aembed_documents(self, texts):
+        if not texts:
+            return []
+
+        loop = asyncio.get_running_loop()
+        self._callers += 1
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            # Estimated like the rate limiter does, counting exactly would tokenize on the loop
+            tokens = len(text) // 4 + 1
+            self._pending.append((text, tokens, self._callers, future))
+            self._pending_tokens += tokens
+            futures.append(future)
+
+        if len(self._pending) >= self.max_batch_size or self._pending_tokens >= self.max_batch_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return list(await asyncio.gather(*futures))
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    # Blocking callers go straight to the model
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+def batched(embeddings):
+    return EmbeddingBatcher(embeddings) if EMBEDDING_BATCHING else embeddings
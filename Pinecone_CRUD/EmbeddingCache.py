@@ -0,0 +1,226 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from utils.metrics import timed, cache_result, embedded_texts
+from utils.disk_cache import LAST_USED_FLUSH_SECONDS
+
+## --------------
+## CONTENT ADDRESSED EMBEDDING CACHE
+## --------------
+# Every vector is keyed by hash(model name, dimension, text), so the same chunk is only ever
+# embedded once. Vectors live on local disk (sqlite, float32 blobs) with an in-memory LRU in
+# front of it. When the file grows past `max_disk_bytes` the least recently used rows are dropped.
+# Hits do not commit, their last_used times are written with the next store (see
+# utils.disk_cache.LAST_USED_FLUSH_SECONDS).
+class CachedEmbeddings:
+    def __init__(
+            self,
+            embeddings,
+            path,
+            dimension=1536,
+            max_memory_items=20000,
+            max_disk_bytes=512 * 1024 * 1024
+        ):
+        self.embeddings = embeddings
+        self.model_name = embeddings.model
+        self.dimension = getattr(embeddings, "dimensions", None) or dimension
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> last_used not written yet
+        self._touched = {}
+        self._flushed_at = time.monotonic()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._db.commit()
+
+        self._disk_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def _key(self, text):
+        return hashlib.sha256(
+            f"{self.model_name}\x00{self.dimension}\x00{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    # Look keys up in memory first and then on disk. Returns {key: vector} for the hits.
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            on_disk = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    on_disk.append(key)
+
+            # sqlite has a limit on the number of bound parameters, so look up in slices.
+            for start in range(0, len(on_disk), 500):
+                batch = on_disk[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+
+                for key, blob in rows:
+                    vector = array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+
+                now = time.time()
+                for key, _ in rows:
+                    self._touched[key] = now
+
+            if time.monotonic() - self._flushed_at > LAST_USED_FLUSH_SECONDS:
+                self._flush_touched()
+                self._db.commit()
+
+        return found
+
+    # Caller holds the lock and commits
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+        self._flushed_at = time.monotonic()
+
+    # Bytes of the rows already stored under `keys` (they are replaced, not added)
+    def _stored_bytes(self, keys):
+        total = 0
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            total += self._db.execute(
+                f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchone()[0]
+        return total
+
+    def _store(self, pairs):
+        with self._lock:
+            now = time.time()
+            rows = []
+            for key, vector in pairs:
+                self._remember(key, vector)
+                rows.append((key, array("f", vector).tobytes(), now))
+
+            replaced = self._stored_bytes([key for key, _, _ in rows])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows
+            )
+            self._disk_bytes += sum(len(blob) for _, blob, _ in rows) - replaced
+            for key, _, _ in rows:
+                self._touched.pop(key, None)
+            self._flush_touched()
+            self._evict()
+            self._db.commit()
+
+    # Size based eviction: drop least recently used rows until we are back under 90% of the budget.
+    def _evict(self):
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        target = int(self.max_disk_bytes * 0.9)
+        row_bytes = self.dimension * 4
+        to_drop = max(1, (self._disk_bytes - target) // row_bytes + 1)
+
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (to_drop,)
+        )
+        self._disk_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    # Split texts into cached vectors and the (unique) texts still to embed.
+    def _prepare(self, texts):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        hits = sum(1 for key in keys if key in found)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        cache_result("embedding", True, hits)
+        cache_result("embedding", False, len(keys) - hits)
+        embedded_texts.inc(len(missing))
+
+        return keys, found, missing
+
+    def _finish(self, keys, found, missing, vectors):
+        new_pairs = list(zip(missing.keys(), vectors))
+        if new_pairs:
+            self._store(new_pairs)
+        found.update(new_pairs)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        keys, found, missing = self._prepare(texts)
+        vectors = []
+        if missing:
+            with timed("embedding"):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+        return self._finish(keys, found, missing, vectors)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        keys, found, missing = self._prepare(texts)
+        vectors = []
+        if missing:
+            with timed("embedding"):
+                vectors = await self.embeddings.aembed_documents(list(missing.values()))
+        return self._finish(keys, found, missing, vectors)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes
+            }
@@ -1,15 +1,26 @@
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from .Chunker import chunk_texts
+from utils.metrics import timed
 
-# A function to get all the documents of given url.
+# Timed steps of a chunk generator (the splitting work happens lazily inside next())
+def _timed_chunks(chunks):
+    while True:
+        with timed("chunking"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+# A function to get all the chunks of given url (a generator, chunks are produced on demand).
 def get_document(url):
+    # Imported on first use, it pulls in bs4 and the text splitters
+    from langchain_community.document_loaders import WebBaseLoader
+
     loader = WebBaseLoader(url)
-    document = loader.load()
-    
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=20
-    )
-
-    splitted_document = splitter.split_documents(document)
-    return [doc.page_content for doc in splitted_document]
\ No newline at end of file
+    with timed("page_load"):
+        document = loader.load()
+
+    return _timed_chunks(chunk_texts(doc.page_content for doc in document))
+
+# Chunks of a document uploaded by the client (already split in parts by the client).
+def split_document(docs):
+    return _timed_chunks(chunk_texts(docs))
@@ -0,0 +1,162 @@
+import time
+import asyncio
+
+from utils.blocking import run_blocking
+from utils.log import get_logger
+from utils.limits import limiter, call_with_retries
+
+logger = get_logger(__name__)
+
+## --------------
+## INDEX HANDLE REGISTRY
+## --------------
+# Process wide registry of known indexes. Each entry keeps a reusable asyncio index handle
+# (with its own pooled aiohttp connections) so requests no longer pay a control plane
+# round-trip and a fresh client per call. Entries expire after `ttl` seconds and are looked up
+# again from the control plane when they are missing or expired. Lookups and creation for the
+# same index name are serialized, so concurrent first requests for a new notebook create the
+# index only once.
+class IndexRegistry:
+    # `client` returns the Pinecone client (it is only created on first use)
+    def __init__(self, client, dimension=1536, ttl=300, pool_size=None):
+        self.client = client
+        self.dimension = dimension
+        self.ttl = ttl
+        self.pool_size = pool_size
+
+        # name -> (host, handle, expires_at)
+        self._entries = {}
+        self._locks = {}
+        # Replaced handles, running requests may still use them. Closed on shutdown.
+        self._retired = []
+
+    @property
+    def pc(self):
+        return self.client()
+
+    def _lock_for(self, name):
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    # Blocking control plane lookup, runs on the shared pool.
+    def _resolve_host(self, name, create):
+        # Imported here, VECTOR_STORE=local never loads pinecone
+        from pinecone import ServerlessSpec
+        from pinecone.exceptions import NotFoundException
+
+        try:
+            return self.pc.describe_index(name).host
+        except NotFoundException:
+            if not create:
+                raise
+
+        logger.info("Creating index", extra={"fields": {"index": name}})
+        self.pc.create_index(
+            name=name,
+            dimension=self.dimension,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud='aws',
+                region="us-east-1"
+            )
+        )
+        return self.pc.describe_index(name).host
+
+    def _new_handle(self, name, host):
+        if self.pool_size:
+            handle = self.pc.IndexAsyncio(host=host, connection_pool_maxsize=self.pool_size)
+        else:
+            handle = self.pc.IndexAsyncio(host=host)
+        return LimitedIndex(self, name, handle, limiter(f"pinecone:{name}", "PINECONE_INDEX"))
+
+    def _fresh(self, name):
+        entry = self._entries.get(name)
+        if entry and entry[2] > time.monotonic():
+            return entry[1]
+        return None
+
+    async def get(self, name, create=False):
+        handle = self._fresh(name)
+        if handle is not None:
+            return handle
+
+        async with self._lock_for(name):
+            # Someone else may have refreshed it while we waited for the lock
+            handle = self._fresh(name)
+            if handle is not None:
+                return handle
+
+            host = await run_blocking(self._resolve_host, name, create)
+
+            entry = self._entries.get(name)
+            if entry and entry[0] == host:
+                # Same index, keep the pooled connections
+                handle = entry[1]
+            else:
+                if entry:
+                    self._retired.append(entry[1])
+                handle = self._new_handle(name, host)
+
+            self._entries[name] = (host, handle, time.monotonic() + self.ttl)
+            return handle
+
+    # Forget an index, e.g. after the data plane reported that it does not exist any more. With
+    # `handle` (an asyncio index handle), only if the entry still uses it (it may already have
+    # been refreshed by a concurrent call).
+    async def invalidate(self, name, handle=None):
+        entry = self._entries.get(name)
+        if entry is None or (handle is not None and entry[1].handle is not handle):
+            return
+        del self._entries[name]
+        self._retired.append(entry[1])
+
+    async def close(self):
+        handles = [handle for _, handle, _ in self._entries.values()] + self._retired
+        self._entries.clear()
+        self._retired = []
+        for handle in handles:
+            await handle.close()
+
+## --------------
+## RATE LIMITED HANDLES
+## --------------
+# Data plane calls of one index go through its limiter (PINECONE_INDEX_RPM) and are retried when
+# Pinecone throttles or fails with a 5xx. When the index is not found (deleted, or recreated on a
+# new host) the registry entry is dropped and the call is tried once more on a fresh lookup, so
+# the stale handle does not keep failing until its TTL runs out. Everything else is the plain
+# asyncio handle.
+class LimitedIndex:
+    def __init__(self, registry, name, handle, limiter):
+        self.registry = registry
+        self.name = name
+        self.handle = handle
+        self.limiter = limiter
+
+    async def _call(self, method, kwargs):
+        from pinecone.exceptions import NotFoundException
+
+        try:
+            return await call_with_retries(lambda: getattr(self.handle, method)(**kwargs), self.limiter)
+        except NotFoundException:
+            logger.warning("Index not found, looking it up again", extra={"fields": {"index": self.name}})
+            await self.registry.invalidate(self.name, self.handle)
+
+        # Later calls through this object (e.g. the rest of an upload) use the fresh handle too
+        self.handle = (await self.registry.get(self.name)).handle
+        return await call_with_retries(lambda: getattr(self.handle, method)(**kwargs), self.limiter)
+
+    async def upsert(self, **kwargs):
+        return await self._call("upsert", kwargs)
+
+    async def query(self, **kwargs):
+        return await self._call("query", kwargs)
+
+    async def fetch(self, **kwargs):
+        return await self._call("fetch", kwargs)
+
+    async def delete(self, **kwargs):
+        return await self._call("delete", kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
@@ -0,0 +1,165 @@
+import os
+import asyncio
+
+from utils.log import get_logger
+from utils.metrics import timed
+from utils.limits import Overloaded
+from .Chunker import count_tokens
+
+logger = get_logger(__name__)
+
+# An embedding batch is closed at INGEST_BATCH_SIZE chunks or INGEST_BATCH_TOKENS tokens
+# (the embeddings API takes up to 2048 inputs and 300k tokens per request).
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+INGEST_BATCH_TOKENS = int(os.getenv("INGEST_BATCH_TOKENS", "64000"))
+# Vectors per upsert request (pinecone caps requests at 2MB, ~100 vectors of 1536 dimensions)
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+
+## --------------
+## STREAMING INGESTION PIPELINE
+## --------------
+# Chunks are packed into embedding batches (by count and tokens) and embedded and upserted by a
+# small pool of workers. The queue between the producer and the workers is bounded, so at most
+# `concurrency` batches are in flight (plus one being filled) no matter how large the
+# document is. A failing batch is counted as failed on its own, it never redoes the whole
+# document. Throttled and transient upstream errors are already retried by the clients (see
+# utils.limits). An upstream that is still overloaded after those retries stops the whole
+# ingestion with Overloaded, the endpoint answers 503 instead of a partial success.
+
+def new_report():
+    return {
+        "embedded": 0,
+        "written": 0,
+        "skipped": 0,
+        "failed": 0,
+        "batches": 0,
+        "failed_batches": 0
+    }
+
+async def _process_batch(batch, model, index, build_vector, report, on_written):
+    texts = [text for _, text in batch]
+
+    try:
+        embeddings = await model.aembed_documents(texts)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error("Embedding batch failed", extra={"fields": {"error": str(e), "size": len(batch)}})
+        report["failed"] += len(batch)
+        report["failed_batches"] += 1
+        return
+
+    report["embedded"] += len(batch)
+    vectors = []
+    for (position, text), emb in zip(batch, embeddings):
+        if not emb or not isinstance(emb, list):
+            logger.warning("Skipping chunk with missing embedding", extra={"fields": {"position": position}})
+            report["skipped"] += 1
+            continue
+
+        vectors.append(build_vector(position, text, emb))
+
+    # One embedding batch can be several upsert requests
+    for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+        part = vectors[start:start + UPSERT_BATCH_SIZE]
+        try:
+            with timed("upsert"):
+                await index.upsert(vectors=part)
+            report["written"] += len(part)
+            if on_written:
+                on_written(part)
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error("Upsert batch failed", extra={"fields": {"error": str(e), "size": len(part)}})
+            report["failed"] += len(part)
+            report["failed_batches"] += 1
+
+async def _iterate(chunks):
+    if hasattr(chunks, "__aiter__"):
+        async for text in chunks:
+            yield text
+    else:
+        for text in chunks:
+            yield text
+
+async def ingest(
+        chunks,
+        model,
+        index,
+        build_vector,
+        batch_size=INGEST_BATCH_SIZE,
+        batch_tokens=INGEST_BATCH_TOKENS,
+        concurrency=INGEST_CONCURRENCY,
+        report=None,
+        on_written=None
+    ):
+    """
+    Embed and upsert `chunks` (any iterable or async iterable of strings) batch by batch.
+
+    `build_vector(position, text, embedding)` returns the pinecone vector dict for one chunk.
+    Returns a report with the number of vectors written, skipped and failed. Pass `report` to
+    have the counters updated in place while ingestion runs (progress of queued jobs).
+    `on_written(vectors)` is called with every batch that was upserted successfully.
+    """
+    if report is None:
+        report = {}
+    report.update(new_report())
+    queue = asyncio.Queue(maxsize=concurrency)
+    overloaded = None
+
+    async def worker():
+        nonlocal overloaded
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            # Once an upstream is overloaded the remaining batches are dropped
+            if overloaded is not None:
+                continue
+            try:
+                await _process_batch(batch, model, index, build_vector, report, on_written)
+            except Overloaded as e:
+                overloaded = e
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+    try:
+        batch = []
+        tokens = 0
+        position = -1
+        async for text in _iterate(chunks):
+            position += 1
+            if not text or not text.strip():
+                report["skipped"] += 1
+                continue
+
+            size = count_tokens(text)
+            if batch and (len(batch) == batch_size or tokens + size > batch_tokens):
+                if overloaded is not None:
+                    raise overloaded
+                report["batches"] += 1
+                # Waits here while all workers are busy (backpressure)
+                await queue.put(batch)
+                batch = []
+                tokens = 0
+
+            batch.append((position, text))
+            tokens += size
+
+        if batch:
+            report["batches"] += 1
+            await queue.put(batch)
+
+        for _ in workers:
+            await queue.put(None)
+
+        await asyncio.gather(*workers)
+        if overloaded is not None:
+            raise overloaded
+    finally:
+        for task in workers:
+            task.cancel()
+
+    return report
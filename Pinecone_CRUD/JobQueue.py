@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+
+from utils.log import get_logger
+from utils.blocking import run_blocking
+from utils.limits import Overloaded, backoff_delay
+
+logger = get_logger(__name__)
+
+## --------------
+## INGESTION JOB QUEUE
+## --------------
+# Upserts and deletes can be queued instead of running inside the request. Jobs are persisted in
+# a local sqlite file and processed by a fixed number of workers. Jobs of the same index run one
+# at a time in submission order, so a delete never overtakes the upsert it was sent after, while
+# different indexes are processed in parallel. The file can be shared by several server processes:
+# a worker owns the job it claimed for a lease that it renews while the job runs. A job whose lease
+# ran out (its process died) is queued again and picked up by whichever process sees it first.
+# Every sqlite call runs on the blocking pool, a file locked by another process never stalls the
+# event loop, and the workers retry with a backoff instead of dying on a locked database.
+class JobQueue:
+    def __init__(self, path, handlers, workers=2, retention=7 * 24 * 3600, lease=60):
+        # kind -> async handler(payload, progress), its return value becomes the job result
+        self.handlers = handlers
+        self.workers = workers
+        self.retention = retention
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._lock = threading.Lock()
+        # job id -> live progress dict of running jobs
+        self._progress = {}
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                kind TEXT NOT NULL,
+                index_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                owner TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # Files written before leases existed
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, seq)")
+        self._db.commit()
+
+    async def submit(self, kind, index_name, payload):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        try:
+            await run_blocking(self._insert, job_id, kind, index_name, payload)
+        except sqlite3.OperationalError as e:
+            # Still locked after the busy timeout, the client should try again
+            logger.warning("Job queue busy", extra={"fields": {"error": str(e)}})
+            raise Overloaded("job queue") from e
+
+        logger.info("Job queued", extra={"fields": {"job_id": job_id, "kind": kind, "index": index_name}})
+        self._wakeup.set()
+        return job_id
+
+    def _insert(self, job_id, kind, index_name, payload):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, index_name, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, index_name, json.dumps(payload), now, now)
+            )
+            # Finished jobs are only kept around for status polling
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - self.retention,)
+            )
+            self._db.commit()
+
+    async def status(self, job_id):
+        try:
+            row = await run_blocking(self._read, job_id)
+        except sqlite3.OperationalError as e:
+            logger.warning("Job queue busy", extra={"fields": {"error": str(e)}})
+            raise Overloaded("job queue") from e
+
+        if row is None:
+            return None
+
+        job_id, kind, index_name, status, progress, result, error, created_at, updated_at = row
+        return {
+            "jobID": job_id,
+            "kind": kind,
+            "indexID": index_name,
+            "status": status,
+            # Running jobs report their live counters
+            "progress": dict(self._progress[job_id]) if job_id in self._progress else json.loads(progress or "{}"),
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def _read(self, job_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, kind, index_name, status, progress, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+
+    # Jobs of dead owners go back to the queue. They keep their seq, so they run before later jobs
+    # of the same index. Runs inside the caller's transaction.
+    def _requeue_expired(self, now):
+        return self._db.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, updated_at = ? WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+            (now, now)
+        ).rowcount
+
+    # Oldest queued job whose index has no running job, in any process. Only the first queued job
+    # of an index is a candidate, which keeps per index order.
+    def _claim(self):
+        with self._lock:
+            now = time.time()
+            # Take the write lock up front so two processes can't pick the same job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                requeued = self._requeue_expired(now)
+                row = self._db.execute("""
+                    SELECT id, kind, index_name, payload FROM jobs AS j
+                    WHERE status = 'queued'
+                    AND NOT EXISTS (SELECT 1 FROM jobs WHERE index_name = j.index_name AND status = 'running')
+                    AND NOT EXISTS (SELECT 1 FROM jobs WHERE index_name = j.index_name AND status = 'queued' AND seq < j.seq)
+                    ORDER BY seq LIMIT 1
+                """).fetchone()
+
+                claimed = 0
+                if row is not None:
+                    claimed = self._db.execute(
+                        "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+                        (self.owner, now + self.lease, now, row[0])
+                    ).rowcount
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+        if requeued:
+            logger.info("Requeued jobs with an expired lease", extra={"fields": {"count": requeued}})
+
+        if not claimed:
+            return None
+
+        job_id, kind, index_name, payload = row
+        return job_id, kind, index_name, json.loads(payload)
+
+    def _finish(self, job_id, status, progress, result=None, error=None):
+        with self._lock:
+            finished = self._db.execute(
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ? WHERE id = ? AND owner = ?",
+                (status, json.dumps(progress), json.dumps(result) if result is not None else None, error, time.time(), job_id, self.owner)
+            ).rowcount
+            self._db.commit()
+
+        if not finished:
+            # The lease ran out and the job was handed to another worker, its outcome wins
+            logger.warning("Job lease lost before finishing", extra={"fields": {"job_id": job_id, "status": status}})
+
+    def _renew(self):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                (time.time() + self.lease, self.owner)
+            )
+            self._db.commit()
+
+    # Running jobs of this process go back to the queue
+    def _release(self):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, updated_at = ? WHERE owner = ? AND status = 'running'",
+                (time.time(), self.owner)
+            )
+            self._db.commit()
+
+    def _requeue_interrupted(self):
+        with self._lock:
+            requeued = self._requeue_expired(time.time())
+            self._db.commit()
+        return requeued
+
+    # Runs a sqlite call on the blocking pool until it goes through, e.g. while another process
+    # holds the write lock for longer than the busy timeout
+    async def _retrying(self, func, *args):
+        attempt = 0
+        while True:
+            try:
+                return await run_blocking(func, *args)
+            except sqlite3.Error as e:
+                logger.warning("Job queue database call failed, retrying", extra={"fields": {"call": func.__name__, "error": str(e), "attempt": attempt + 1}})
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    # Keeps the leases of this process' running jobs alive and wakes the workers, so jobs submitted
+    # or unblocked by other processes are seen. A failed renewal is tried again on the next beat.
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await run_blocking(self._renew)
+            except sqlite3.Error as e:
+                logger.warning("Failed to renew job leases", extra={"fields": {"error": str(e)}})
+            self._wakeup.set()
+
+    async def _run(self, job_id, kind, index_name, payload):
+        progress = self._progress[job_id] = {}
+        started = time.perf_counter()
+        try:
+            result = await self.handlers[kind](payload, progress)
+            await self._retrying(self._finish, job_id, "done", progress, result)
+            logger.info("Job done", extra={"fields": {"job_id": job_id, "kind": kind, "duration_ms": round((time.perf_counter() - started) * 1000, 1)}})
+        except asyncio.CancelledError:
+            # Server is stopping, stop() hands the job back to the queue
+            raise
+        except Exception as e:
+            logger.exception("Job failed", extra={"fields": {"job_id": job_id, "kind": kind}})
+            await self._retrying(self._finish, job_id, "failed", progress, None, str(e))
+        finally:
+            self._progress.pop(job_id, None)
+            # The index is free again, its next job can run
+            self._wakeup.set()
+
+    async def _worker(self):
+        attempt = 0
+        while True:
+            try:
+                # Cleared before the claim, a job submitted while it runs wakes the worker again
+                self._wakeup.clear()
+                job = await self._retrying(self._claim)
+                if job is None:
+                    await self._wakeup.wait()
+                    continue
+                await self._run(*job)
+                attempt = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Never lose a worker, the job (if any) is requeued once its lease expires
+                logger.exception("Job worker failed")
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    async def start(self):
+        try:
+            requeued = await run_blocking(self._requeue_interrupted)
+        except sqlite3.Error as e:
+            # The workers requeue expired jobs on every claim as well
+            logger.warning("Failed to requeue interrupted jobs", extra={"fields": {"error": str(e)}})
+            requeued = 0
+
+        if requeued:
+            logger.info("Requeued interrupted jobs", extra={"fields": {"count": requeued}})
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # Interrupted jobs can run again right away instead of waiting for their lease to expire
+        try:
+            await run_blocking(self._release)
+        except sqlite3.Error as e:
+            logger.warning("Failed to release running jobs, they are requeued when their lease expires", extra={"fields": {"error": str(e)}})
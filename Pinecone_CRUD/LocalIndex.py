@@ -0,0 +1,287 @@
+import os
+import json
+import sqlite3
+import asyncio
+import numpy as np
+
+## --------------
+## LOCAL VECTOR STORE
+## --------------
+# An in-process backend with the same async interface we use from the pinecone index:
+#     upsert(vectors), query(vector, top_k, filter, include_metadata), fetch(ids),
+#     delete(ids / filter), close()
+# Vectors are kept L2 normalized in a memory-mapped float32 file per index, so cosine top-k is
+# one matrix-vector product. Metadata lives in a sqlite file next to it. A per-source row index
+# on `source_key` / `source_urlID` makes the usual per-source filters a lookup instead of a scan.
+
+INDEXED_FIELDS = ("source_key", "source_urlID")
+
+class Match(dict):
+    # Pinecone results support both match['metadata'] and match.metadata
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+class QueryResult:
+    def __init__(self, matches):
+        self.matches = matches
+
+class FetchResult:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+class LocalIndex:
+    def __init__(self, path, dimension=1536, initial_capacity=1024):
+        self.path = path
+        self.dimension = dimension
+
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+
+        self._db = sqlite3.connect(os.path.join(path, "rows.sqlite3"))
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+        # id -> row, row -> (id, metadata), (field, value) -> set of rows
+        self._rows = {}
+        self._meta = {}
+        self._by_source = {}
+
+        for row, vector_id, metadata in self._db.execute("SELECT row, id, metadata FROM rows"):
+            self._add_row(row, vector_id, json.loads(metadata))
+
+        used = max(self._meta, default=-1) + 1
+        self._free = sorted(set(range(used)) - set(self._meta), reverse=True)
+        self._open_matrix(max(initial_capacity, used))
+
+        # Rows currently holding a vector
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        if self._meta:
+            self._alive[list(self._meta)] = True
+
+    def _open_matrix(self, capacity):
+        if not os.path.exists(self._vectors_path):
+            open(self._vectors_path, "wb").close()
+
+        needed = capacity * self.dimension * 4
+        if os.path.getsize(self._vectors_path) < needed:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(needed)
+
+        self._capacity = os.path.getsize(self._vectors_path) // (self.dimension * 4)
+        self._matrix = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(self._capacity, self.dimension)
+        )
+
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+
+        self._matrix.flush()
+        del self._matrix
+        self._open_matrix(capacity)
+
+        alive = np.zeros(self._capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._alive = alive
+
+    def _add_row(self, row, vector_id, metadata):
+        self._rows[vector_id] = row
+        self._meta[row] = (vector_id, metadata)
+        for field in INDEXED_FIELDS:
+            if field in metadata:
+                self._by_source.setdefault((field, metadata[field]), set()).add(row)
+
+    def _remove_row(self, row):
+        vector_id, metadata = self._meta.pop(row)
+        del self._rows[vector_id]
+        for field in INDEXED_FIELDS:
+            if field in metadata:
+                rows = self._by_source.get((field, metadata[field]))
+                if rows is not None:
+                    rows.discard(row)
+                    if not rows:
+                        del self._by_source[(field, metadata[field])]
+        self._alive[row] = False
+        self._free.append(row)
+
+    # Rows matching a pinecone style metadata filter ({field: value}, $eq or $in). None = all rows.
+    def _filter_rows(self, filter):
+        if not filter:
+            return None
+
+        rows = None
+        for field, condition in filter.items():
+            if isinstance(condition, dict):
+                if "$eq" in condition:
+                    values = [condition["$eq"]]
+                elif "$in" in condition:
+                    values = condition["$in"]
+                else:
+                    raise ValueError(f"Unsupported filter operator in {condition}")
+            else:
+                values = [condition]
+
+            if field in INDEXED_FIELDS:
+                matched = set()
+                for value in values:
+                    matched |= self._by_source.get((field, value), set())
+            else:
+                matched = {
+                    row for row, (_, metadata) in self._meta.items()
+                    if metadata.get(field) in values
+                }
+
+            rows = matched if rows is None else rows & matched
+
+        return rows
+
+    def _match(self, row, score=None, include_values=False, include_metadata=True):
+        vector_id, metadata = self._meta[row]
+        match = Match(id=vector_id)
+        if score is not None:
+            match["score"] = score
+        if include_values:
+            match["values"] = self._matrix[row].tolist()
+        if include_metadata:
+            match["metadata"] = metadata
+        return match
+
+    async def upsert(self, vectors, **kwargs):
+        new_rows = sum(1 for vector in vectors if vector["id"] not in self._rows)
+        needed = max(self._meta, default=-1) + 1 + max(0, new_rows - len(self._free))
+        if needed > self._capacity:
+            self._grow(needed)
+
+        records = []
+        for vector in vectors:
+            values = np.asarray(vector["values"], dtype=np.float32)
+            norm = np.linalg.norm(values)
+            metadata = vector.get("metadata") or {}
+
+            if vector["id"] in self._rows:
+                row = self._rows[vector["id"]]
+                self._remove_row(row)
+                self._free.remove(row)
+            else:
+                row = self._free.pop() if self._free else len(self._meta)
+
+            self._matrix[row] = values / norm if norm else values
+            self._alive[row] = True
+            self._add_row(row, vector["id"], metadata)
+            records.append((row, vector["id"], json.dumps(metadata)))
+
+        self._db.executemany(
+            "INSERT OR REPLACE INTO rows (row, id, metadata) VALUES (?, ?, ?)",
+            records
+        )
+        self._db.commit()
+        self._matrix.flush()
+        return {"upserted_count": len(records)}
+
+    async def query(self, vector, top_k=10, filter=None, include_metadata=False, include_values=False, **kwargs):
+        rows = self._filter_rows(filter)
+        if rows is None:
+            rows = np.flatnonzero(self._alive)
+        else:
+            rows = np.array(sorted(rows), dtype=np.int64)
+
+        if len(rows) == 0:
+            return QueryResult([])
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self._matrix[rows] @ query
+
+        # Top k by score, ties broken by row so the result is deterministic
+        k = min(top_k, len(rows))
+        if k < len(rows):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(rows))
+        order = candidates[np.lexsort((rows[candidates], -scores[candidates]))]
+
+        return QueryResult([
+            self._match(int(rows[i]), float(scores[i]), include_values, include_metadata)
+            for i in order
+        ])
+
+    async def fetch(self, ids, **kwargs):
+        return FetchResult({
+            vector_id: self._match(self._rows[vector_id], include_values=True)
+            for vector_id in ids
+            if vector_id in self._rows
+        })
+
+    # Same shape as the pinecone asyncio client: an async generator of pages of ids
+    async def list(self, prefix=None, limit=100, **kwargs):
+        ids = sorted(vector_id for vector_id in self._rows if not prefix or vector_id.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    async def delete(self, ids=None, filter=None, delete_all=False, **kwargs):
+        if delete_all:
+            rows = set(self._meta)
+        elif ids is not None:
+            rows = {self._rows[vector_id] for vector_id in ids if vector_id in self._rows}
+        else:
+            rows = self._filter_rows(filter) or set()
+
+        for row in rows:
+            self._remove_row(row)
+
+        self._db.executemany("DELETE FROM rows WHERE row = ?", [(row,) for row in rows])
+        self._db.commit()
+        return {}
+
+    async def close(self):
+        self._matrix.flush()
+
+## --------------
+## LOCAL INDEX REGISTRY
+## --------------
+# Same interface as IndexRegistry, but every index is a directory under `root`.
+class LocalIndexRegistry:
+    def __init__(self, root, dimension=1536):
+        self.root = root
+        self.dimension = dimension
+        self._indexes = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, name, create=False):
+        if name in self._indexes:
+            return self._indexes[name]
+
+        async with self._lock:
+            if name not in self._indexes:
+                path = os.path.join(self.root, name)
+                if not create and not os.path.isdir(path):
+                    raise KeyError(f"Index {name} does not exist")
+                self._indexes[name] = LocalIndex(path, dimension=self.dimension)
+
+        return self._indexes[name]
+
+    async def invalidate(self, name):
+        index = self._indexes.pop(name, None)
+        if index:
+            await index.close()
+
+    async def close(self):
+        for index in self._indexes.values():
+            await index.close()
+        self._indexes.clear()
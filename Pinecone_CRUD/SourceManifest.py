@@ -0,0 +1,98 @@
+import os
+import time
+import sqlite3
+import threading
+
+## --------------
+## SOURCE MANIFEST
+## --------------
+# Which vector ids belong to every url/document of an index, in document order. Kept up to date
+# by the upsert functions, so deletes can go out as id deletes (no metadata filter scans) and the
+# chunks of one source can be fetched directly by id. The same source uploaded to two indexes
+# has two entries. Sources ingested before the manifest existed are unknown (`ids` returns None)
+# and callers fall back to the index.
+class SourceManifest:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+
+        # Manifests from before index names were stored can not tell indexes apart, drop them
+        # (their sources fall back to the index until they are upserted again)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(manifest_sources)")]
+        if columns and "index_name" not in columns:
+            self._db.execute("DROP TABLE manifest_sources")
+            self._db.execute("DROP TABLE IF EXISTS manifest_vectors")
+
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS manifest_sources (
+                index_name TEXT NOT NULL,
+                source_type TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (index_name, source_type, source_id)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS manifest_vectors (
+                index_name TEXT NOT NULL,
+                source_type TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                vector_id TEXT NOT NULL,
+                PRIMARY KEY (index_name, source_type, source_id, position)
+            )
+        """)
+        self._db.commit()
+
+    # Vector ids of a source in document order, None when the source is not in the manifest
+    def ids(self, index_name, source_type, source_id, limit=None):
+        with self._lock:
+            known = self._db.execute(
+                "SELECT 1 FROM manifest_sources WHERE index_name = ? AND source_type = ? AND source_id = ?",
+                (index_name, source_type, source_id)
+            ).fetchone()
+            if known is None:
+                return None
+
+            rows = self._db.execute(
+                "SELECT vector_id FROM manifest_vectors WHERE index_name = ? AND source_type = ? AND source_id = ? ORDER BY position LIMIT ?",
+                (index_name, source_type, source_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [vector_id for vector_id, in rows]
+
+    def replace(self, index_name, source_type, source_id, ids):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM manifest_vectors WHERE index_name = ? AND source_type = ? AND source_id = ?",
+                (index_name, source_type, source_id)
+            )
+            self._db.executemany(
+                "INSERT INTO manifest_vectors (index_name, source_type, source_id, position, vector_id) VALUES (?, ?, ?, ?, ?)",
+                [(index_name, source_type, source_id, position, vector_id) for position, vector_id in enumerate(ids)]
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO manifest_sources (index_name, source_type, source_id, updated_at) VALUES (?, ?, ?, ?)",
+                (index_name, source_type, source_id, time.time())
+            )
+            self._db.commit()
+
+    def drop(self, index_name, source_type, source_id):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM manifest_vectors WHERE index_name = ? AND source_type = ? AND source_id = ?",
+                (index_name, source_type, source_id)
+            )
+            self._db.execute(
+                "DELETE FROM manifest_sources WHERE index_name = ? AND source_type = ? AND source_id = ?",
+                (index_name, source_type, source_id)
+            )
+            self._db.commit()
+
+source_manifest = SourceManifest(
+    os.getenv("SOURCE_MANIFEST_PATH", ".cache/manifest.sqlite3")
+)
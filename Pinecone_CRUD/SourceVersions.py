@@ -0,0 +1,73 @@
+import os
+import time
+import sqlite3
+import threading
+
+## --------------
+## SOURCE CONTENT VERSIONS
+## --------------
+# Every url/document of an index has a content version which changes whenever the source is
+# upserted or deleted there. Caches built on top of a source (e.g. summaries) put the version in
+# their key, so a changed source can never be served from a stale entry. The same docID in two
+# notebooks has two versions. Versions are never evicted.
+class SourceVersions:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+
+        # Versions from before index names were stored can not tell indexes apart, drop them
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(source_versions)")]
+        if columns and "index_name" not in columns:
+            self._db.execute("DROP TABLE source_versions")
+            self._db.execute("DROP TABLE IF EXISTS source_versions_base")
+
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS source_versions (
+                index_name TEXT NOT NULL,
+                source_type TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                version TEXT NOT NULL,
+                PRIMARY KEY (index_name, source_type, source_id)
+            )
+        """)
+        # Version of sources that were never bumped. It is new whenever the table is, so entries
+        # cached against a dropped version can not match again.
+        self._db.execute("CREATE TABLE IF NOT EXISTS source_versions_base (version TEXT NOT NULL)")
+        row = self._db.execute("SELECT version FROM source_versions_base").fetchone()
+        if row is None:
+            row = (f"{time.time_ns():x}",)
+            self._db.execute("INSERT INTO source_versions_base (version) VALUES (?)", row)
+        self._base = row[0]
+        self._db.commit()
+
+    def bump(self, index_name, source_type, source_id):
+        version = f"{time.time_ns():x}"
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO source_versions (index_name, source_type, source_id, version) VALUES (?, ?, ?, ?)",
+                (index_name, source_type, source_id, version)
+            )
+            self._db.commit()
+        return version
+
+    # {(source_type, source_id): version} for the given sources of an index
+    def get_many(self, index_name, sources):
+        versions = {source: self._base for source in sources}
+        with self._lock:
+            for source_type, source_id in sources:
+                row = self._db.execute(
+                    "SELECT version FROM source_versions WHERE index_name = ? AND source_type = ? AND source_id = ?",
+                    (index_name, source_type, source_id)
+                ).fetchone()
+                if row:
+                    versions[(source_type, source_id)] = row[0]
+        return versions
+
+source_versions = SourceVersions(
+    os.getenv("SOURCE_VERSIONS_PATH", ".cache/sources.sqlite3")
+)
@@ -1,177 +1,474 @@
 import os
-from langchain_openai import OpenAIEmbeddings
+import asyncio
+import hashlib
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
-from .GetDocuments import get_document
-import uuid
+from .GetDocuments import get_document, split_document
+from .EmbeddingCache import CachedEmbeddings
+from .EmbeddingBatcher import batched
+from .Ingestion import ingest, new_report
+from .IndexRegistry import IndexRegistry
+from .LocalIndex import LocalIndexRegistry
+from .SourceVersions import source_versions
+from .SourceManifest import source_manifest
+from .JobQueue import JobQueue
+from getSummary.sources import schedule_source_summary, drop_source_summary
+from utils.blocking import iterate_blocking
+from utils.log import get_logger
+from utils.metrics import timed, vector_counts
+from utils.limits import Overloaded
+from utils.clients import LazyEmbeddings, pinecone_client
 
 load_dotenv()
 
-model = OpenAIEmbeddings(
-    model="text-embedding-3-small"  
+logger = get_logger(__name__)
+
+# Embeddings are cached on local disk, so re-uploading a document or url does not embed it again.
+# Cache misses of concurrent requests are merged into batched embedding requests.
+model = CachedEmbeddings(
+    batched(LazyEmbeddings()),
+    path=os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3"),
+    max_memory_items=int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "20000")),
+    max_disk_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024
 )
 
-pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+# "pinecone" (default) or "local": in-process memory-mapped indexes, for offline benchmarks and CI
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+
+# Sources of one bulk request synced at once, and NDJSON lines buffered per streamed source
+BULK_SOURCE_CONCURRENCY = int(os.getenv("BULK_SOURCE_CONCURRENCY", "4"))
+BULK_BUFFERED_LINES = int(os.getenv("BULK_BUFFERED_LINES", "4"))
 
 ## --------------
 ## CREATE INDEXES
 ## --------------
-def create_index(index_name):
-    if index_name not in pc.list_indexes().names():
-        pc.create_index(
-            name=index_name,
-            dimension=1536,
-            metric="cosine",
-            spec=ServerlessSpec(
-                cloud='aws',
-                region="us-east-1"
-            )
-        )
+# Known indexes and their reusable asyncio handles, shared by every request.
+if VECTOR_STORE == "local":
+    index_registry = LocalIndexRegistry(
+        root=os.getenv("LOCAL_INDEX_PATH", ".cache/indexes"),
+        dimension=1536
+    )
+else:
+    # The Pinecone client is created by the first request that needs it
+    index_registry = IndexRegistry(
+        pinecone_client,
+        dimension=1536,
+        ttl=int(os.getenv("INDEX_REGISTRY_TTL", "300")),
+        pool_size=int(os.getenv("PINECONE_POOL_SIZE", "0")) or None
+    )
 
-    index = pc.Index(index_name)
-    return index
+async def create_index(index_name):
+    return await index_registry.get(index_name, create=True)
+
+async def get_index(index_name):
+    # Index always exits
+    return await index_registry.get(index_name)
 
 ## --------------
-## UPSERT DOCUMENTS
+## UPSERT REPORTS
 ## --------------
-def upsert_document_data(docs, DOCID, index):
-    try:
-        print("Upserting document with source_key =", DOCID)
-        embeddings = model.embed_documents(docs)
+# Turn an ingestion report into the message the client already understands
+def _report_message(report):
+    if report["written"] == 0 and report["failed"] == 0 and not report.get("unchanged"):
+        report["message"] = "We failed to get information from profived file. Nothing to upsert"
+    elif report["failed"]:
+        report["message"] = f"Partially upserted: {report['written']} written, {report['failed']} failed"
+    else:
+        report["message"] = "Data Upserted Successfully!"
+
+    vector_counts.inc(report["written"], result="written")
+    vector_counts.inc(report["skipped"], result="skipped")
+    vector_counts.inc(report["failed"], result="failed")
+    vector_counts.inc(report.get("deleted", 0), result="deleted")
+    logger.info("Upsert report", extra={"fields": {"report": report, "embedding_cache": model.stats()}})
+    return report
+
+## --------------
+## CHUNK IDS
+## --------------
+# Pinecone accepts at most 1000 ids per delete call
+DELETE_BATCH_SIZE = 1000
+
+# Vector ids are "{type}:{source id}#{hash of the chunk text}". Ids of different sources never
+# collide, re-uploading the same content writes the same ids, and all vectors of one source can
+# be listed by prefix.
+def source_prefix(source_type, source_id):
+    return f"{source_type}:{source_id}#"
+
+def chunk_id(prefix, text):
+    return prefix + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+async def _list_ids(index, prefix):
+    ids = []
+    async for page in index.list(prefix=prefix):
+        ids.extend(page)
+    return ids
+
+async def _delete_ids(index, ids):
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        await index.delete(ids=ids[start:start + DELETE_BATCH_SIZE])
+
+# Most vectors one query returns (pinecone's top_k limit)
+LEGACY_QUERY_TOP_K = 10000
+
+# Vectors of a source written before content hash ids ("doc-{i}", "doc-{uuid}"). They can only be
+# found by their metadata, the ones under the source's prefix are left out.
+async def _legacy_ids(index, metadata_field, source_id, prefix):
+    with timed("query"):
+        results = await index.query(
+            vector=[0.0]*1536,
+            top_k=LEGACY_QUERY_TOP_K,
+            filter={metadata_field: {"$eq": source_id}}
+        )
+    return [match['id'] for match in results.matches if not match['id'].startswith(prefix)]
+
+# Notebooks (indexes) get a content version too, for caches that only know the notebook id
+# (e.g. chat answers). Bumped whenever any of its sources changed.
+def _notebook_changed(indexID):
+    if indexID is not None:
+        source_versions.bump(indexID, 'notebook', indexID)
+
+# Diff the chunks against what the index already holds for this source: only new chunks are
+# embedded and written, chunks that disappeared are deleted, unchanged ones are left alone.
+# `chunks` is streamed straight into ingestion, only the ids are kept in memory.
+async def _sync_source(chunks, source_type, source_id, metadata_field, index, report=None, indexID=None):
+    if report is None:
+        report = {}
+
+    prefix = source_prefix(source_type, source_id)
+    known = source_manifest.ids(indexID, source_type, source_id)
+    # The manifest of this process may be stale (or another pod wrote the source last), so what
+    # the index lists under the source's prefix counts too. The manifest still covers writes the
+    # listing does not show yet.
+    existing = set(known or []) | set(await _list_ids(index, prefix))
+
+    # ids in document order, a chunk repeated in the source is stored once
+    order = []
+    seen = set()
+    report["unchanged"] = 0
 
-        vectors = []
-        for i, emb in enumerate(embeddings):
-            if not emb or not isinstance(emb, list):
-                print(f"Skipping doc {i}: missing embedding")
+    async def new_chunks():
+        async for text in chunks:
+            if not text or not text.strip():
                 continue
 
-            vectors.append({
-                "id": f"doc-{uuid.uuid4()}",
-                "values": emb,
-                "metadata": {
-                    "text": docs[i],
-                    "source_key": DOCID
-                }
-            })
+            vector_id = chunk_id(prefix, text)
+            if vector_id in seen:
+                continue
+            seen.add(vector_id)
+            order.append(vector_id)
 
-        if not vectors:
-            print("No valid vectors to upsert")
-            return "We failed to get information from profived file. Nothing to upsert"
+            if vector_id in existing:
+                report["unchanged"] += 1
+                continue
+            yield text
 
-        res = index.upsert(vectors=vectors)
-        print("Upsert response:", res)
-        return "Data Upserted Successfully!"
+    def build_vector(position, text, emb):
+        return {
+            "id": chunk_id(prefix, text),
+            "values": emb,
+            "metadata": {
+                "text": text,
+                metadata_field: source_id
+            }
+        }
 
-    except Exception as e:
-        print("Upsert failed:", e)
-        return "Failed"
+    written = set()
+    def on_written(vectors):
+        written.update(vector["id"] for vector in vectors)
+
+    report = await ingest(new_chunks(), model, index, build_vector, report=report, on_written=on_written)
+
+    # No chunks at all (empty upload, empty or blocked page) is a failed upload, not an empty
+    # source: what the index holds for it stays as it is
+    report["deleted"] = 0
+    if not seen:
+        return report
+
+    # Unchanged chunks plus the new ones that made it into the index, in document order.
+    # Failed chunks are left out so the next upsert retries them.
+    ids = [vector_id for vector_id in order if vector_id in existing or vector_id in written]
+
+    stale = [vector_id for vector_id in existing if vector_id not in seen]
+    if report["failed"]:
+        # Partial upload: the old chunks stay (and in the manifest) until a full upload replaces them
+        ids.extend(stale)
+    else:
+        # First upload since the manifest: the source may still have vectors from before content
+        # hash ids, the new chunks replace them
+        if known is None:
+            stale.extend(await _legacy_ids(index, metadata_field, source_id, prefix))
+        with timed("delete"):
+            await _delete_ids(index, stale)
+        report["deleted"] = len(stale)
+
+    source_manifest.replace(indexID, source_type, source_id, ids)
+
+    # Content changed, invalidate everything cached on top of this source
+    if report["written"] or report["deleted"]:
+        source_versions.bump(indexID, source_type, source_id)
+        _notebook_changed(indexID)
+
+    # Summarize the source now (no-op while its summary is current), notebook summaries reuse it.
+    # Not from a partial upload, the retry that completes it bumps the version again.
+    if not report["failed"]:
+        schedule_source_summary(indexID, source_type, source_id, lambda: _fetch_texts(index, ids))
+    return report
+
+## --------------
+## UPSERT DOCUMENTS
+## --------------
+async def upsert_document_data(docs, DOCID, index, report=None, indexID=None):
+    # The client's parts are re-split into token sized chunks
+    return await upsert_document_chunks(iterate_blocking(split_document, docs), DOCID, index, report=report, indexID=indexID)
+
+async def upsert_document_chunks(chunks, DOCID, index, report=None, indexID=None):
+    logger.info("Upserting document", extra={"fields": {"source_key": DOCID}})
+    report = await _sync_source(chunks, 'doc', DOCID, 'source_key', index, report=report, indexID=indexID)
+    return _report_message(report)
 
 ## --------------
 ## UPSERT VALUES
 ## --------------
-def upsert_url_content(url, index, docID):
+async def upsert_url_content(url, index, docID, report=None, indexID=None):
+    logger.info("Upserting url", extra={"fields": {"source_urlID": docID}})
+    if report is None:
+        report = {}
+
     try:
-        print("Upserting url with source_urlID =", docID)
-        texts = get_document(url)
-        embeddings = model.embed_documents(texts)
-
-        vectors = []
-        for i, emb in enumerate(embeddings):
-            vectors.append({
-                "id": f"doc-{i}",
-                "values": emb,
-                "metadata": {
-                    "text": texts[i],
-                    "source_urlID": docID
-                }
-            })
-
-        res = index.upsert(vectors=vectors)
-        print("Upsert response:", res)
-        return "Data Upserted Successfully!"
-    except:
-        return "Failed to Upsert!"        
+        # The page is loaded and split on the blocking pool while the chunks are embedded
+        report = await _sync_source(iterate_blocking(get_document, url), 'url', docID, 'source_urlID', index, report=report, indexID=indexID)
+    except Overloaded:
+        # Answered with a 503, the client should try again later
+        raise
+    except Exception as e:
+        logger.exception("Failed to load url", extra={"fields": {"url": url}})
+        for key, value in new_report().items():
+            report.setdefault(key, value)
+        report["message"] = "Failed to Upsert!"
+        return report
+
+    return _report_message(report)
 
 ## -------------
 ## Delete URLs and Documents
 ## -------------    
-def delete_source(index, docid, docType):
+async def delete_source(index, docid, docType, indexID=None):
     try:
-        print("Deleting docs with source_key =", docid)
-        if docType == 'doc':
-            res = index.delete(
-                filter={"source_key": {"$eq": docid}}
-            )
-        else:
-            res = index.delete(
-                filter={"source_urlID": {"$eq": docid}}
-            )
-        print("Delete response:", res)
+        logger.info("Deleting source", extra={"fields": {"source": docid, "type": docType}})
+        source_type = 'doc' if docType == 'doc' else 'url'
+        # The manifest of this process may be stale (or another pod's), so everything under the
+        # source's id prefix goes too. The manifest still covers writes the listing does not
+        # show yet.
+        known = source_manifest.ids(indexID, source_type, docid)
+        ids = list(dict.fromkeys((known or []) + await _list_ids(index, source_prefix(source_type, docid))))
+
+        if ids:
+            # Batched id deletes, no metadata filter scan
+            with timed("delete"):
+                await _delete_ids(index, ids)
+            vector_counts.inc(len(ids), result="deleted")
+            logger.info("Deleted vectors", extra={"fields": {"count": len(ids)}})
+
+        # Not upserted since the manifest: vectors from before content hash ids only match by
+        # metadata. Once a source is in the manifest its first upsert has removed them.
+        if known is None:
+            if docType == 'doc':
+                res = await index.delete(
+                    filter={"source_key": {"$eq": docid}}
+                )
+            else:
+                res = await index.delete(
+                    filter={"source_urlID": {"$eq": docid}}
+                )
+            logger.info("Delete response", extra={"fields": {"response": res}})
+
+        source_manifest.drop(indexID, source_type, docid)
+        drop_source_summary(indexID, source_type, docid)
+        source_versions.bump(indexID, source_type, docid)
+        _notebook_changed(indexID)
         return "Data Deleted successfully!"
+    except Overloaded:
+        raise
     except Exception as e:
-        print("Delete failed:", e)
+        logger.exception("Delete failed")
         return f"Failed to delete embeddings: {e}"
 
 ## --------------
-## FIND SUMMARY QUERY
+## BULK INGESTION
 ## --------------
-def getContext(indexID, allurlIDs, alldocIDs):
-    final_context = ""
+# Many sources of one index in one call. `records` is an async iterable of
+#   {"type": "doc", "docID": ..., "docs": [...]}, {"type": "url", "docID": ..., "url": ...}
+# A document may be spread over consecutive records with the same docID (one per NDJSON line),
+# its parts are chunked and embedded as they arrive, chunks do not span two records. Sources are
+# synced BULK_SOURCE_CONCURRENCY at a time through the same embedding model, so the
+# micro-batcher merges the embedding calls of different sources into shared requests. Every
+# source gets its own result, in request order, and a failing source does not stop the others.
+def invalid_source(record, deleting=False):
+    if "error" in record:
+        return record["error"]
+    if record.get("type") not in ('doc', 'url'):
+        return "type must be 'doc' or 'url'"
+    if not record.get("docID"):
+        return "docID is required"
+    if not deleting and record["type"] == 'url' and not record.get("url"):
+        return "url is required"
+    if not deleting and record["type"] == 'doc' and not isinstance(record.get("docs", []), list):
+        return "docs must be a list of texts"
+    return None
 
-    query_text = "general information in the document" # General query for all document to get summary. 
-    # Generate embeddings of above query using GPT embedding model.
-    query_embedding = model.embed_query(query_text)
+async def upsert_sources(records, index, indexID=None, concurrency=BULK_SOURCE_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+    tasks = []
+    # (type, docID) of the document still receiving records, and its queue of parts
+    current, lines = None, None
+    seen = set()
 
-    # Index always exits
-    index = pc.Index(indexID)
-
-    final_context += "URL Content: \n"
-    if (allurlIDs):
-        for urlID in allurlIDs:
-            # Get 5 context infomation object for every url information
-            results = index.query(
-                vector=query_embedding,
-                top_k=5,
-                filter = { 
-                    'source_urlID': urlID
-                },
-                include_metadata=True
-            )
-
-            # Return text from those objects
-            final_context += '\n'.join([docs['metadata']['text'] for docs in results.matches])
-
-    final_context += "\n==============\n"
-    final_context += "DOCUMENT Content: \n"
-
-    if (alldocIDs):
-        for docid in alldocIDs:
-            # Get 2 context infomation object for every docs information
-            results = index.query(
-                vector=query_embedding,
-                top_k=3,
-                filter = { 
-                    'source_key': docid
-                },
-                include_metadata=True
-            )
-
-            # Return text from those objects
-            final_context += '\n'.join([docs['metadata']['text'] for docs in results.matches])
-
-    return final_context
-
-def getSpecificContext(sourceType, sourceID, indexID):
-    # Index always exits
-    index = pc.Index(indexID)
+    async def sync(result, record, lines):
+        # The parts of a document arrive on `lines` until None
+        ended = False
+        async def chunks():
+            nonlocal ended
+            while (docs := await lines.get()) is not None:
+                async for chunk in iterate_blocking(split_document, docs):
+                    yield chunk
+            ended = True
 
-    results = index.query(
-        vector=[0.0]*1536,
-        top_k=10,
-        filter = {'source_urlID': sourceID} if sourceType == "URL" else {'source_key': sourceID},
-        include_metadata=True
-    )
+        try:
+            if record["type"] == 'url':
+                report = await upsert_url_content(record["url"], index, record["docID"], indexID=indexID)
+            else:
+                report = await upsert_document_chunks(chunks(), record["docID"], index, indexID=indexID)
+            result.update(report)
+        except Exception as e:
+            logger.exception("Bulk upsert of source failed", extra={"fields": {"type": record["type"], "source": record["docID"]}})
+            result.update(new_report(), message="Failed to Upsert!", error=str(e))
+            # Keep taking the rest of the document so reading the body goes on
+            if lines is not None and not ended:
+                while await lines.get() is not None:
+                    pass
+        finally:
+            semaphore.release()
+
+    async def finish_document():
+        if lines is not None:
+            await lines.put(None)
+
+    try:
+        async for record in records:
+            error = invalid_source(record)
+            key = (record.get("type"), record.get("docID"))
+            if error is None and key == current:
+                # Next part of the document being streamed
+                await lines.put(record.get("docs") or [])
+                continue
+
+            await finish_document()
+            current, lines = None, None
+            if error is None and key in seen:
+                error = "source sent twice, all records of a source must be consecutive"
+            if error is not None:
+                results.append({"type": record.get("type"), "docID": record.get("docID"), "message": "Failed to Upsert!", "error": error})
+                continue
+
+            seen.add(key)
+            result = {"type": key[0], "docID": key[1]}
+            results.append(result)
+            if key[0] == 'doc':
+                current, lines = key, asyncio.Queue(maxsize=BULK_BUFFERED_LINES)
+                await lines.put(record.get("docs") or [])
+
+            # Waits while `concurrency` sources are syncing, which also stops reading the body
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(sync(result, record, lines)))
+
+        await finish_document()
+        await asyncio.gather(*tasks)
+    finally:
+        # The client went away or the body was broken, do not keep syncing for nobody
+        for task in tasks:
+            task.cancel()
 
-    context = '\n'.join([docs['metadata']['text'] for docs in results.matches])
+    return results
 
-    return context
\ No newline at end of file
+async def delete_sources(records, index, indexID=None, concurrency=BULK_SOURCE_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete(record):
+        error = invalid_source(record, deleting=True)
+        result = {"type": record.get("type"), "docID": record.get("docID")}
+        if error is not None:
+            return {**result, "message": "Failed to delete", "error": error}
+        async with semaphore:
+            return {**result, "message": await delete_source(index, record["docID"], record["type"], indexID=indexID)}
+
+    return await asyncio.gather(*[delete(record) async for record in records])
+
+## --------------
+## SOURCE TEXTS
+## --------------
+# Number of chunks (from the start of the source) used as context of a single source
+SPECIFIC_CONTEXT_CHUNKS = int(os.getenv("SPECIFIC_CONTEXT_CHUNKS", "10"))
+FETCH_BATCH_SIZE = 100
+
+# Texts of the given vector ids, in the same order, and whether all of them were found. Right
+# after an upsert, serverless reads may not see every new vector yet.
+async def _fetch_texts(index, ids):
+    batches = [ids[start:start + FETCH_BATCH_SIZE] for start in range(0, len(ids), FETCH_BATCH_SIZE)]
+    with timed("fetch"):
+        results = await asyncio.gather(*[index.fetch(ids=batch) for batch in batches])
+    texts = [
+        result.vectors[vector_id]['metadata']['text']
+        for batch, result in zip(batches, results)
+        for vector_id in batch
+        if vector_id in result.vectors
+    ]
+    return texts, len(texts) == len(ids)
+
+# Chunks of one source ('url' or 'doc') in document order, all of them unless `limit` is given,
+# and whether all of them could be read
+async def get_source_texts(indexID, source_type, source_id, limit=None):
+    index = await get_index(indexID)
+
+    ids = source_manifest.ids(indexID, source_type, source_id, limit=limit)
+    if ids is not None:
+        return await _fetch_texts(index, ids)
+
+    # Not in the manifest (ingested before it existed): any chunks of the source
+    with timed("query"):
+        results = await index.query(
+            vector=[0.0]*1536,
+            top_k=limit or SPECIFIC_CONTEXT_CHUNKS,
+            filter = {'source_urlID': source_id} if source_type == 'url' else {'source_key': source_id},
+            include_metadata=True
+        )
+
+    return [docs['metadata']['text'] for docs in results.matches], True
+
+## --------------
+## INGESTION JOBS
+## --------------
+# Queued variants of the upsert and delete endpoints. `progress` is the live ingestion report
+# of the running job.
+async def _upsert_documents_job(payload, progress):
+    index = await create_index(payload['indexID'])
+    return await upsert_document_data(payload['docs'], payload['docID'], index, report=progress, indexID=payload['indexID'])
+
+async def _upsert_url_job(payload, progress):
+    index = await create_index(payload['indexID'])
+    return await upsert_url_content(payload['url'], index, payload['docID'], report=progress, indexID=payload['indexID'])
+
+async def _delete_source_job(payload, progress):
+    index = await create_index(payload['indexID'])
+    return {'message': await delete_source(index, payload['docID'], payload['docType'], indexID=payload['indexID'])}
+
+job_queue = JobQueue(
+    path=os.getenv("JOB_QUEUE_PATH", ".cache/jobs.sqlite3"),
+    handlers={
+        "upsert_documents": _upsert_documents_job,
+        "upsert_url": _upsert_url_job,
+        "delete_source": _delete_source_job
+    },
+    workers=int(os.getenv("INGEST_JOB_WORKERS", "2")),
+    lease=float(os.getenv("INGEST_JOB_LEASE_SECONDS", "60"))
+)
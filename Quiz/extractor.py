@@ -1,15 +1,55 @@
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled
+import os
+from utils.blocking import run_blocking
+from utils.disk_cache import DiskCache
+from utils.singleflight import SingleFlight
+from utils.metrics import timed, cache_result
+from utils.providers import provider
 
-ytt_api = YouTubeTranscriptApi()
+@provider("youtube_transcript_api")
+def ytt_api():
+    from youtube_transcript_api import YouTubeTranscriptApi
+    return YouTubeTranscriptApi()
+
+NO_TRANSCRIPT_MESSAGE = "This video has no transcripts enabled."
+
+# Normalized transcripts keyed by video ID, persisted on local disk
+transcript_cache = DiskCache(
+    path=os.getenv("QUIZ_CACHE_PATH", ".cache/quiz.sqlite3"),
+    table="transcripts",
+    ttl=int(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "2000"))
+)
+
+# Concurrent requests for the same video fetch its transcript only once
+_fetches = SingleFlight()
 
 # Get Video ID
 def getID(url):
     id = url.split('=')
     return id[-1]
 
+# Collapse whitespace so the same transcript always looks the same
+def normalize_transcript(text):
+    return ' '.join(text.split())
+
+async def _fetch_transcript(video_id):
+    # youtube_transcript_api only has a blocking client, so it runs on the shared pool
+    with timed("transcript_fetch"):
+        fetched = await run_blocking(ytt_api().fetch, video_id)
+    transcript = normalize_transcript(' '.join([transcript.text for transcript in fetched]))
+    transcript_cache.set(video_id, transcript)
+    return transcript
+
 # Get Transcript
-def get_transript(video_id):
+async def get_transript(video_id):
+    transcript = transcript_cache.get(video_id)
+    cache_result("transcript", transcript is not None)
+    if transcript is not None:
+        return transcript
+
+    from youtube_transcript_api import TranscriptsDisabled
+
     try:
-        return ' '.join([transcript.text for transcript in ytt_api.fetch(video_id)])
+        return await _fetches.do(video_id, lambda: _fetch_transcript(video_id))
     except TranscriptsDisabled:
-        return "This video has no transcripts enabled."
\ No newline at end of file
+        return NO_TRANSCRIPT_MESSAGE
@@ -1,21 +1,43 @@
+import os
+import asyncio
+import numpy as np
+from functools import cache
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.exceptions import OutputParserException
+from pydantic import ValidationError
 
 from schema.output.quizSchema import QuizStructure
+# Only used to find near duplicate questions: the shared, cached and batched embedding model
+from Pinecone_CRUD.main import model as embeddings
+from utils.log import get_logger
+from utils.clients import chat_openai
+from utils.providers import provider
 
 load_dotenv()
 
-model = ChatOpenAI(
-    model='gpt-5-nano'
-)
+logger = get_logger(__name__)
+
+# Defaults, every one of them can be overridden per call
+QUIZ_COUNT = int(os.getenv("QUIZ_COUNT", "5"))
+QUIZ_CONCURRENCY = int(os.getenv("QUIZ_CONCURRENCY", "5"))
+QUIZ_TIMEOUT = float(os.getenv("QUIZ_TIMEOUT", "60"))
+QUIZ_SEGMENT_WORDS = int(os.getenv("QUIZ_SEGMENT_WORDS", "1500"))
+QUIZ_DEDUP_THRESHOLD = float(os.getenv("QUIZ_DEDUP_THRESHOLD", "0.9"))
+# Sequential mode: attempts per question when the model's answer is not a valid quiz
+QUIZ_MAX_RETRIES = 3
+# Parallel mode: generation rounds to top up the questions dedup dropped
+QUIZ_MAX_ROUNDS = int(os.getenv("QUIZ_MAX_ROUNDS", "3"))
 
 parser = PydanticOutputParser(pydantic_object=QuizStructure)
 
-structuredOutput = model.with_structured_output(QuizStructure)
+# Rendered when the first prompt is formatted, not at import
+@cache
+def format_instructions():
+    return parser.get_format_instructions()
 
-template = """
+rules = """
 Generate EXACTLY ONE quiz question strictly from the provided transcript.
 
 RULES:
@@ -35,7 +57,9 @@ QUIZ REQUIREMENTS:
 - Exactly four answer options with only one correct.
 - Answer index must match the correct option.
 - Explanation must be 40-50 words and based only on the transcript.
+"""
 
+template = rules + """
 DUPLICATE PREVENTION:
 Do NOT repeat, rephrase, or generate semantically similar questions from the list below.
 If no distinct question can be generated, respond with the missing-transcript message.
@@ -53,35 +77,190 @@ Previously Generated Questions:
 prompt = PromptTemplate(
     template=template,
     input_variables=["transcript", "previous_questions"],
-    partial_variables={"format_instructions": parser.get_format_instructions()}
+    partial_variables={"format_instructions": format_instructions}
 )
 
-chain = prompt | structuredOutput
+# Parallel candidates do not see each other, a different focus per candidate keeps their
+# prompts (and so their questions) apart instead
+parallel_template = rules + """
+FOCUS:
+Ask about {aspect}, taken from part {part} of {parts} of the transcript (parts by position, in order).
+
+Transcript:
+{transcript}
+
+Format Instructions:
+{format_instructions}
+"""
 
-def generate_quiz(transcript):
+parallel_prompt = PromptTemplate(
+    template=parallel_template,
+    input_variables=["transcript", "aspect", "part", "parts"],
+    partial_variables={"format_instructions": format_instructions}
+)
+
+ASPECTS = [
+    "a key fact",
+    "the reason or cause behind something",
+    "a concept or definition",
+    "the steps of a process",
+    "a comparison or contrast",
+    "an example that is given",
+    "a conclusion or takeaway",
+    "a specific name, number or date"
+]
+
+# Built with the shared chat model on first use
+@provider("quiz_chain")
+def chain():
+    return prompt | chat_openai().with_structured_output(QuizStructure)
+
+@provider("quiz_parallel_chain")
+def parallel_chain():
+    return parallel_prompt | chat_openai().with_structured_output(QuizStructure)
+
+## --------------
+## SEQUENTIAL GENERATION
+## --------------
+# One question at a time over the full transcript, duplicates are prevented by the prompt.
+async def _generate_sequential(transcript, count):
     generated_quizzes = []
     previous_questions = []
 
-    MAX_QUIZZES = 5
-    MAX_RETRIES = 3
-
-    for i in range(MAX_QUIZZES):
-        for attempt in range(MAX_RETRIES):
+    for i in range(count):
+        for attempt in range(QUIZ_MAX_RETRIES):
             try:
-                result = chain.invoke({
+                result = await chain().ainvoke({
                     "transcript": transcript,
                     "previous_questions": previous_questions or "None"
                 })
+                if result is None:
+                    raise OutputParserException("The model did not return a quiz")
 
                 generated_quizzes.append(result.dict())
                 previous_questions.append(result.question)
+                break
 
-                break 
-
+            except (OutputParserException, ValidationError) as e:
+                # A malformed answer is asked for again, transport errors are retried by the client
+                if attempt == QUIZ_MAX_RETRIES - 1:
+                    logger.warning("Failed to generate unique quiz", extra={"fields": {"quiz": i + 1, "error": str(e)}})
             except Exception as e:
-                if attempt == MAX_RETRIES - 1:
-                    print(f"Failed to generate unique quiz {i+1}: {e}")
-                continue
-    print(f"{i+1} Quiz generated")
+                logger.warning("Failed to generate unique quiz", extra={"fields": {"quiz": i + 1, "error": str(e)}})
+                break
+    logger.info("Quizzes generated", extra={"fields": {"count": len(generated_quizzes), "mode": "sequential"}})
     
-    return generated_quizzes
\ No newline at end of file
+    return generated_quizzes
+
+## --------------
+## PARALLEL GENERATION
+## --------------
+# Split the transcript into word segments so every request sends only a part of it.
+def _segment_transcript(transcript, segment_words, overlap_words=50):
+    words = transcript.split()
+    if len(words) <= segment_words:
+        return [transcript]
+
+    step = segment_words - overlap_words
+    return [
+        ' '.join(words[start:start + segment_words])
+        for start in range(0, len(words) - overlap_words, step)
+    ]
+
+# Greedily keep questions whose embedding is not too close to an already kept one.
+async def dedup_questions(quizzes, threshold=QUIZ_DEDUP_THRESHOLD):
+    if len(quizzes) < 2:
+        return quizzes
+
+    vectors = np.array(
+        await embeddings.aembed_documents([quiz["question"] for quiz in quizzes]),
+        dtype=np.float32
+    )
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+
+    kept = []
+    for i in range(len(quizzes)):
+        if not kept or float(np.max(vectors[kept] @ vectors[i])) < threshold:
+            kept.append(i)
+        else:
+            logger.info("Dropping near duplicate question", extra={"fields": {"question": quizzes[i]['question']}})
+
+    return [quizzes[i] for i in kept]
+
+async def _generate_parallel(transcript, count, concurrency, timeout):
+    segments = _segment_transcript(transcript, QUIZ_SEGMENT_WORDS)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    # Candidates are spread over the segments, and over parts of each segment and question
+    # aspects, so no two of them send the same prompt
+    parts = -(-(count + max(1, count // 2)) // len(segments))
+
+    async def generate_one(i):
+        try:
+            async with semaphore:
+                result = await parallel_chain().ainvoke({
+                    "transcript": segments[i % len(segments)],
+                    "aspect": ASPECTS[i % len(ASPECTS)],
+                    "part": (i // len(segments)) % parts + 1,
+                    "parts": parts
+                })
+            return (i, result.dict())
+        except Exception as e:
+            logger.warning("Failed to generate quiz", extra={"fields": {"quiz": i + 1, "error": str(e)}})
+            return (i, None)
+
+    quizzes = []
+    generated = 0
+    rounds = 0
+    for _ in range(QUIZ_MAX_ROUNDS):
+        missing = count - len(quizzes)
+        remaining = deadline - loop.time()
+        if missing <= 0 or remaining <= 0:
+            break
+        rounds += 1
+
+        # Ask for a few more questions than needed, some of them will be near duplicates
+        candidates = range(generated, generated + missing + max(1, missing // 2))
+        generated = candidates.stop
+
+        tasks = [asyncio.create_task(generate_one(i)) for i in candidates]
+        done, pending = await asyncio.wait(tasks, timeout=remaining)
+
+        # Whatever did not finish within the deadline is dropped
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Quiz requests timed out", extra={"fields": {"pending": len(pending), "timeout": timeout}})
+
+        # Keep candidate order so the result does not depend on which call finished first
+        results = sorted(task.result() for task in done if task.result()[1] is not None)
+        if not results:
+            break
+        # Questions kept in earlier rounds come first and stay
+        quizzes = await dedup_questions(quizzes + [quiz for _, quiz in results])
+
+    logger.info("Quizzes generated", extra={"fields": {"count": min(len(quizzes), count), "candidates": generated, "rounds": rounds, "mode": "parallel"}})
+
+    return quizzes[:count]
+
+async def generate_quiz(
+        transcript,
+        count=QUIZ_COUNT,
+        concurrency=QUIZ_CONCURRENCY,
+        timeout=QUIZ_TIMEOUT,
+        mode="parallel"
+    ):
+    """
+    Generate `count` quizzes from a transcript.
+
+    - parallel (default): concurrent requests over transcript segments, each with its own focus,
+      near duplicate questions are removed locally by embedding similarity and another round tops
+      them up (up to QUIZ_MAX_ROUNDS). Calls still running after `timeout` seconds are dropped.
+    - sequential: the previous behaviour, one question at a time over the whole transcript.
+    """
+    if mode == "sequential":
+        return await _generate_sequential(transcript, count)
+
+    return await _generate_parallel(transcript, count, concurrency, timeout)
@@ -0,0 +1,87 @@
+import os
+import random
+import asyncio
+
+from utils.disk_cache import DiskCache
+from utils.singleflight import SingleFlight
+from utils.log import get_logger
+from utils.metrics import cache_result
+from . import extractor, generator
+
+logger = get_logger(__name__)
+
+# Once a video's pool holds this many questions we stop topping it up
+QUIZ_POOL_TARGET = int(os.getenv("QUIZ_POOL_TARGET", "20"))
+QUIZ_POOL_MAX = int(os.getenv("QUIZ_POOL_MAX", "50"))
+
+# Pool of generated quizzes per video ID, persisted on local disk
+quiz_pools = DiskCache(
+    path=os.getenv("QUIZ_CACHE_PATH", ".cache/quiz.sqlite3"),
+    table="quiz_pools",
+    ttl=int(os.getenv("QUIZ_POOL_TTL", str(3 * 24 * 3600))),
+    max_entries=int(os.getenv("QUIZ_POOL_MAX_VIDEOS", "500"))
+)
+
+# Concurrent requests for the same video share one generation
+_generations = SingleFlight()
+
+# Keep references to background top ups so they are not garbage collected
+_background_tasks = set()
+
+async def _add_to_pool(video_id, quizzes):
+    pool = quiz_pools.get(video_id, [])
+    merged = await generator.dedup_questions(pool + quizzes)
+    quiz_pools.set(video_id, merged[:QUIZ_POOL_MAX])
+
+async def _generate_for_pool(video_id, count, **options):
+    transcript = await extractor.get_transript(video_id)
+    if transcript == extractor.NO_TRANSCRIPT_MESSAGE:
+        return []
+
+    quizzes = await generator.generate_quiz(transcript, count=count, **options)
+    if quizzes:
+        await _add_to_pool(video_id, quizzes)
+    return quizzes
+
+async def _top_up(video_id):
+    try:
+        await _generations.do(
+            video_id,
+            lambda: _generate_for_pool(video_id, generator.QUIZ_COUNT)
+        )
+    except Exception as e:
+        logger.exception("Failed to top up quiz pool", extra={"fields": {"video_id": video_id}})
+
+def _schedule_top_up(video_id, pool_size):
+    if pool_size >= QUIZ_POOL_TARGET or _generations.running(video_id):
+        return
+
+    task = asyncio.create_task(_top_up(video_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def get_quizzes(video_id, count, **options):
+    """
+    Answer from the video's cached pool when it holds enough questions (and top it up in the
+    background), otherwise generate now. `options` are passed on to generator.generate_quiz.
+    """
+    pool = quiz_pools.get(video_id, [])
+    if len(pool) >= count:
+        cache_result("quiz_pool", True)
+        logger.info("Serving quizzes from pool", extra={"fields": {"video_id": video_id, "count": count, "pool": len(pool)}})
+        _schedule_top_up(video_id, len(pool))
+        return random.sample(pool, count)
+
+    cache_result("quiz_pool", False)
+    quizzes = await _generations.do(
+        video_id,
+        lambda: _generate_for_pool(video_id, count, **options)
+    )
+
+    # We may have joined a generation started with a smaller count
+    if len(quizzes) < count:
+        pool = quiz_pools.get(video_id, [])
+        if len(pool) > len(quizzes):
+            return random.sample(pool, min(count, len(pool)))
+
+    return quizzes[:count]
@@ -0,0 +1,236 @@
+import re
+import time
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+from langchain_core.tools import tool
+from langchain_core.runnables import RunnableLambda
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+## --------------
+## FAKE UPSTREAMS
+## --------------
+# Local stand-ins for every upstream the server talks to. Each one takes a latency (seconds)
+# so the benchmark can model slow or fast upstreams without any network access.
+
+# Text returned by the fake retrieval tool, the fake chat model answers once it sees it
+TOOL_RESULT_MARKER = "Benchmark context for"
+
+# Swap the upstream model of a CachedEmbeddings (behind the micro-batcher when there is one)
+def install_embeddings(cached, fake):
+    if hasattr(cached.embeddings, "max_batch_size"):
+        cached.embeddings.embeddings = fake
+    else:
+        cached.embeddings = fake
+
+class FakeEncoding:
+    """Stands in for the tiktoken encoding (the real one downloads its vocabulary): one token per word."""
+    def encode(self, text, **kwargs):
+        return re.findall(r"\s*\S+\s*|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+class FakeEmbeddings:
+    """Stands in for OpenAIEmbeddings: deterministic vectors derived from the text hash."""
+    def __init__(self, latency=0.05, per_text_latency=0.0005, dimension=1536, model="text-embedding-3-small"):
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.dimension = dimension
+        self.dimensions = None
+        self.model = model
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        values = [(b - 127.5) / 127.5 for b in digest]
+        return (values * (self.dimension // len(values) + 1))[:self.dimension]
+
+    def _delay(self, count):
+        self.calls += 1
+        self.texts += count
+        return self.latency + self.per_text_latency * count
+
+    async def aembed_documents(self, texts, **kwargs):
+        await asyncio.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text, **kwargs):
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts, **kwargs):
+        time.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text, **kwargs):
+        return self.embed_documents([text])[0]
+
+class FakeStructuredModel:
+    """Stands in for ChatOpenAI(...).with_structured_output(schema): returns `make()` after a delay."""
+    def __init__(self, make, latency=1.0):
+        self.make = make
+        self.latency = latency
+        self.calls = 0
+
+    def runnable(self):
+        async def run(prompt_value):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            return self.make()
+        return RunnableLambda(run)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stands in for the tool calling ChatOpenAI of the chat agent. The first turn calls the first
+    bound tool, once the tool result is in the prompt it streams `answer` token by token.
+    """
+    latency: float = 0.5
+    token_latency: float = 0.005
+    answer: str = "This is a benchmark answer " * 20
+    tool_name: str = "retrieve_context"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        if tools:
+            self.tool_name = tools[0].name
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError("The benchmark only uses the async path")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = None
+        async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+        return ChatResult(generations=[
+            ChatGeneration(message=AIMessage(content=message.content, tool_calls=message.tool_calls))
+        ])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+
+        # The agent node puts the latest message (the tool result after a tool call) into the prompt
+        if not any(TOOL_RESULT_MARKER in str(message.content) for message in messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{
+                    "name": self.tool_name,
+                    "args": '{"query": "benchmark"}',
+                    "id": "call-1",
+                    "index": 0
+                }]
+            ))
+            return
+
+        for token in self.answer.split(" "):
+            await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(token + " ", chunk=chunk)
+            yield chunk
+
+class FakeMCPClient:
+    """Stands in for MultiServerMCPClient with a single retrieval tool."""
+    def __init__(self, latency=0.2, tool_latency=0.3):
+        self.latency = latency
+        self.tool_latency = tool_latency
+
+    async def get_tools(self):
+        await asyncio.sleep(self.latency)
+        tool_latency = self.tool_latency
+
+        @tool
+        async def retrieve_context(query: str) -> str:
+            """Retrieve the top_k document chunks of the notebook for a query."""
+            await asyncio.sleep(tool_latency)
+            return f"{TOOL_RESULT_MARKER} {query}"
+
+        return [retrieve_context]
+
+class FakeYouTubeTranscriptApi:
+    """Stands in for YouTubeTranscriptApi. Blocking on purpose, like the real client."""
+    def __init__(self, latency=0.5, words=3000):
+        self.latency = latency
+        self.words = words
+
+    def fetch(self, video_id):
+        time.sleep(self.latency)
+        return [
+            SimpleNamespace(text=f"{video_id} transcript sentence number {i}.")
+            for i in range(self.words // 5)
+        ]
+
+class FakePineconeIndex:
+    """Stands in for the asyncio pinecone index (upsert/query/fetch/delete/list)."""
+    def __init__(self, latency=0.03):
+        self.latency = latency
+        self.vectors = {}
+
+    async def upsert(self, vectors, **kwargs):
+        await asyncio.sleep(self.latency)
+        for vector in vectors:
+            self.vectors[vector["id"]] = vector
+        return {"upserted_count": len(vectors)}
+
+    def _matches(self, filter):
+        for vector in self.vectors.values():
+            metadata = vector.get("metadata", {})
+            ok = True
+            for field, condition in (filter or {}).items():
+                if isinstance(condition, dict):
+                    values = [condition["$eq"]] if "$eq" in condition else condition.get("$in", [])
+                else:
+                    values = [condition]
+                ok = ok and metadata.get(field) in values
+            if ok:
+                yield vector
+
+    async def query(self, vector, top_k=10, filter=None, include_metadata=False, **kwargs):
+        await asyncio.sleep(self.latency)
+        matches = [
+            {"id": v["id"], "score": 0.5, "metadata": v.get("metadata", {})}
+            for v in self._matches(filter)
+        ][:top_k]
+        return SimpleNamespace(matches=matches)
+
+    async def fetch(self, ids, **kwargs):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(vectors={i: self.vectors[i] for i in ids if i in self.vectors})
+
+    async def delete(self, ids=None, filter=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        doomed = list(ids or []) if ids is not None else [v["id"] for v in self._matches(filter)]
+        for vector_id in doomed:
+            self.vectors.pop(vector_id, None)
+        return {}
+
+    async def list(self, prefix=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        yield [vector_id for vector_id in self.vectors if not prefix or vector_id.startswith(prefix)]
+
+    async def close(self):
+        pass
+
+class FakeIndexRegistry:
+    """Stands in for IndexRegistry, one FakePineconeIndex per index name."""
+    def __init__(self, latency=0.03):
+        self.latency = latency
+        self.indexes = {}
+
+    async def get(self, name, create=False):
+        if name not in self.indexes:
+            self.indexes[name] = FakePineconeIndex(self.latency)
+        return self.indexes[name]
+
+    async def invalidate(self, name):
+        self.indexes.pop(name, None)
+
+    async def close(self):
+        self.indexes.clear()
@@ -0,0 +1,114 @@
+"""
+Throughput benchmark of the embedding micro-batcher, fully offline.
+
+Many concurrent callers make small embedding calls (like queries and small uploads do) against
+the fake embedding model, once straight to the model and once through EmbeddingBatcher. Reports
+throughput, per call latency and the number of upstream requests of both modes as JSON.
+
+Example:
+    python benchmarks/run_embedding_batcher.py --callers 100 --calls 20 --output batcher.json
+    python benchmarks/run_embedding_batcher.py --upstream-concurrency 8 --wait-ms 2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import fakes
+from benchmarks.run_endpoints import summarize, git_commit
+from Pinecone_CRUD.EmbeddingBatcher import EmbeddingBatcher
+
+MODES = ["unbatched", "batched"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding micro-batcher against the fake embedding model")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--callers", type=int, default=50, help="concurrent callers")
+    parser.add_argument("--calls", type=int, default=20, help="embedding calls per caller")
+    parser.add_argument("--texts-per-call", type=int, default=1)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="round trip of one upstream request")
+    parser.add_argument("--per-text-latency", type=float, default=0.0005)
+    parser.add_argument("--upstream-concurrency", type=int, default=0,
+                        help="upstream requests allowed at once, e.g. a rate limited account (0 = unlimited)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--wait-ms", type=float, default=5)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+class LimitedEmbeddings(fakes.FakeEmbeddings):
+    """The fake model with a cap on concurrent requests."""
+    def __init__(self, concurrency, **kwargs):
+        super().__init__(**kwargs)
+        self.slots = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def aembed_documents(self, texts, **kwargs):
+        if self.slots is None:
+            return await super().aembed_documents(texts, **kwargs)
+        async with self.slots:
+            return await super().aembed_documents(texts, **kwargs)
+
+async def run_mode(mode, args):
+    upstream = LimitedEmbeddings(
+        args.upstream_concurrency,
+        latency=args.embed_latency,
+        per_text_latency=args.per_text_latency
+    )
+    if mode == "batched":
+        model = EmbeddingBatcher(
+            upstream,
+            max_batch_size=args.batch_size,
+            max_wait_ms=args.wait_ms,
+            max_in_flight=args.in_flight
+        )
+    else:
+        model = upstream
+
+    latencies = []
+
+    async def caller(worker):
+        for call in range(args.calls):
+            texts = [f"caller {worker} call {call} text {i}" for i in range(args.texts_per_call)]
+            started = time.perf_counter()
+            await model.aembed_documents(texts)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[caller(worker) for worker in range(args.callers)])
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, 0, elapsed)
+    result["texts_per_second"] = upstream.texts / elapsed if elapsed else None
+    result["upstream_requests"] = upstream.calls
+    result["texts_per_request"] = upstream.texts / upstream.calls if upstream.calls else None
+    return result
+
+def main():
+    args = parse_args()
+
+    modes = {}
+    for mode in args.modes:
+        modes[mode] = asyncio.run(run_mode(mode, args))
+        print(f"{mode}: {json.dumps(modes[mode])}", file=sys.stderr)
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "modes": modes
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
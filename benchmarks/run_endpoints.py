@@ -0,0 +1,280 @@
+"""
+Endpoint benchmark for main.py, fully offline.
+
+Every upstream (OpenAI embeddings and chat, Pinecone, the MCP server, YouTube and web page
+loading) is replaced by a local fake with configurable latency, the app is driven in-process
+through httpx and the results (p50/p95/p99 latency, requests per second, peak RSS) are written
+as JSON so runs can be compared across commits.
+
+Example:
+    python benchmarks/run_endpoints.py --requests 50 --concurrency 10 --output bench.json
+    python benchmarks/run_endpoints.py --endpoints getAIResponse --background generateQuiz=4
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENDPOINTS = [
+    "upsert_documents",
+    "upsert_url_info",
+    "upsert_sources",
+    "getSummary",
+    "getSummaryForEveryDoc",
+    "getAIResponse",
+    "generateQuiz"
+]
+
+INDEX_ID = "bench-notebook"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the python-server endpoints against local fakes")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--key-space", type=int, default=0,
+                        help="number of distinct payloads per endpoint (0 = every request is distinct, no cache hits)")
+    parser.add_argument("--background", nargs="*", default=[],
+                        help="endpoint=N: keep N requests of this endpoint running while measuring the others")
+    parser.add_argument("--chunks", type=int, default=50, help="chunks per uploaded document / url")
+    parser.add_argument("--sources", type=int, default=10, help="sources per /getSummary and /upsert_sources request")
+    parser.add_argument("--vector-store", choices=["fake", "local"], default="fake")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--index-latency", type=float, default=0.03)
+    parser.add_argument("--mcp-latency", type=float, default=0.2)
+    parser.add_argument("--youtube-latency", type=float, default=0.5)
+    parser.add_argument("--loader-latency", type=float, default=0.3)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+def setup_environment(args, workdir):
+    # Dummy credentials so clients can be constructed, caches live in a throw away directory
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("PINECONE_API_KEY", "benchmark")
+    os.environ.setdefault("HORIZON_ACCESS_TOKEN", "benchmark")
+    os.environ.setdefault("USER_AGENT", "python-server-benchmark")
+    if args.vector_store == "local":
+        os.environ["VECTOR_STORE"] = "local"
+    os.chdir(workdir)
+
+def install_fakes(args):
+    from benchmarks import fakes
+    import Pinecone_CRUD.main as pinecone_crud
+    import Pinecone_CRUD.Chunker as chunker
+    import getSummary.main as summary
+    import Chat.main as chat
+    from utils import clients
+    from Quiz import extractor, generator
+    from schema.output.quizSchema import QuizStructure
+
+    chunker._encoding = fakes.FakeEncoding()
+    embeddings = fakes.FakeEmbeddings(latency=args.embed_latency)
+    fakes.install_embeddings(pinecone_crud.model, embeddings)
+
+    if args.vector_store == "fake":
+        pinecone_crud.index_registry = fakes.FakeIndexRegistry(latency=args.index_latency)
+
+    def load_page(url):
+        time.sleep(args.loader_latency)
+        return [f"{url} paragraph {i} with some benchmark text." for i in range(args.chunks)]
+    pinecone_crud.get_document = load_page
+
+    summary_model = fakes.FakeStructuredModel(
+        lambda: summary.output_structure(
+            summary="Benchmark summary of the notebook.",
+            questions=["First?", "Second?", "Third?"]
+        ),
+        latency=args.llm_latency
+    ).runnable()
+    summary.chain.set(summary.prompt | summary_model)
+    summary.reduce_chain.set(summary.reduce_prompt | summary_model)
+
+    counter = {"n": 0}
+    def make_quiz():
+        counter["n"] += 1
+        return QuizStructure(
+            question=f"Benchmark question number {counter['n']}?",
+            options=["A. one", "B. two", "C. three", "D. four"],
+            answer=0,
+            explanation="Benchmark explanation."
+        )
+    quiz_model = fakes.FakeStructuredModel(make_quiz, latency=args.llm_latency).runnable()
+    generator.chain.set(generator.prompt | quiz_model)
+    generator.parallel_chain.set(generator.parallel_prompt | quiz_model)
+
+    extractor.ytt_api.set(fakes.FakeYouTubeTranscriptApi(latency=args.youtube_latency))
+
+    chat.client.set(fakes.FakeMCPClient(latency=args.mcp_latency, tool_latency=args.index_latency * 3))
+    clients.chat_openai.set(fakes.FakeChatModel(latency=args.llm_latency / 2))
+
+    return embeddings
+
+def payload(endpoint, i, args):
+    k = i if args.key_space == 0 else i % args.key_space
+
+    if endpoint == "upsert_documents":
+        return {
+            "indexID": INDEX_ID,
+            "docID": f"doc-{k}",
+            "docs": [f"Document {k} chunk {j} with some benchmark text." for j in range(args.chunks)]
+        }
+    if endpoint == "upsert_url_info":
+        return {"indexID": INDEX_ID, "docID": f"url-{k}", "url": f"https://example.com/page/{k}"}
+    if endpoint == "upsert_sources":
+        return {
+            "indexID": INDEX_ID,
+            "sources": [
+                {"type": "doc", "docID": f"bulk-{k}-{j}", "docs": [f"Bulk {k} source {j} chunk {c} with some benchmark text." for c in range(args.chunks)]}
+                if j % 2 == 0 else
+                {"type": "url", "docID": f"bulk-{k}-{j}", "url": f"https://example.com/bulk/{k}/{j}"}
+                for j in range(args.sources)
+            ]
+        }
+    if endpoint == "getSummary":
+        return {
+            "indexID": INDEX_ID,
+            "allurlsID": [f"url-{j}" for j in range(args.sources // 2)],
+            # The extra source makes every key distinct for the summary cache
+            "alldocsID": [f"doc-{j}" for j in range(args.sources - args.sources // 2)] + [f"bench-{k}"]
+        }
+    if endpoint == "getSummaryForEveryDoc":
+        return {"indexID": INDEX_ID, "sourceType": "DOC", "sourceID": f"doc-{k}"}
+    if endpoint == "getAIResponse":
+        return {
+            "query": f"Benchmark question {k}",
+            "pastConverstation": "",
+            "userID": "bench-user",
+            "notebookID": INDEX_ID
+        }
+    if endpoint == "generateQuiz":
+        return {"youtubeURLLink": f"https://www.youtube.com/watch?v=bench{k}"}
+    raise ValueError(endpoint)
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+def summarize(latencies, errors, elapsed):
+    ms = [value * 1000 for value in latencies]
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "mean_ms": sum(ms) / len(ms) if ms else None,
+        "max_ms": max(ms) if ms else None,
+        "rps": len(latencies) / elapsed if elapsed else None
+    }
+
+async def run_endpoint(client, endpoint, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/{endpoint}", json=payload(endpoint, i, args))
+                if response.status_code != 200:
+                    errors += 1
+                    return
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+async def background_load(client, endpoint, workers, args, stop):
+    async def loop(worker):
+        i = 0
+        while not stop.is_set():
+            try:
+                await client.post(f"/{endpoint}", json=payload(endpoint, 100000 + worker * 10000 + i, args))
+            except Exception:
+                pass
+            i += 1
+
+    await asyncio.gather(*[loop(worker) for worker in range(workers)])
+
+async def run(args):
+    import httpx
+    import main
+
+    embeddings = install_fakes(args)
+    report = {}
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+            stop = asyncio.Event()
+            background = []
+            for spec in args.background:
+                endpoint, _, workers = spec.partition("=")
+                background.append(asyncio.create_task(
+                    background_load(client, endpoint, int(workers or 1), args, stop)
+                ))
+
+            for endpoint in args.endpoints:
+                report[endpoint] = await run_endpoint(client, endpoint, args)
+                print(f"{endpoint}: {json.dumps(report[endpoint])}", file=sys.stderr)
+
+            stop.set()
+            await asyncio.gather(*background)
+
+    upstream_calls = {
+        "embedding_calls": embeddings.calls,
+        "embedded_texts": embeddings.texts
+    }
+    return report, upstream_calls
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "-C", ROOT, "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory(prefix="python-server-bench-") as workdir:
+        setup_environment(args, workdir)
+        endpoints, upstream_calls = asyncio.run(run(args))
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "endpoints": endpoints,
+        "upstream_calls": upstream_calls,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+    text = json.dumps(result, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
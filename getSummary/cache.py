@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+
+from utils.disk_cache import DiskCache
+from utils.singleflight import SingleFlight
+from utils.metrics import cache_result
+from utils.log import get_logger
+from Pinecone_CRUD.SourceVersions import source_versions
+from .main import getResponse, output_structure
+
+logger = get_logger(__name__)
+
+## --------------
+## SUMMARY CACHE
+## --------------
+# Summaries keyed by (indexID, sorted sources, content version of every source). Upserts and
+# deletes bump the version of their source, so a changed notebook never gets a stale summary.
+summary_cache = DiskCache(
+    path=os.getenv("SUMMARY_CACHE_PATH", ".cache/summaries.sqlite3"),
+    table="summaries",
+    ttl=int(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "5000"))
+)
+
+# Identical concurrent requests share one LLM call
+_summaries = SingleFlight()
+
+# sources: list of (source_type, source_id) where source_type is 'url' or 'doc'
+def summary_key(kind, indexID, sources):
+    versions = source_versions.get_many(indexID, sources)
+    parts = sorted([source_type, source_id, versions[(source_type, source_id)]] for source_type, source_id in sources)
+    return hashlib.sha256(json.dumps([kind, indexID, parts]).encode("utf-8")).hexdigest()
+
+async def get_summary(key, load_context, summarize=getResponse):
+    """
+    Return the cached summary for `key` or build it: `load_context` is awaited for the context
+    and whether it is complete, the result of `summarize(context)` is only cached for a complete
+    context.
+    """
+    cached = summary_cache.get(key)
+    cache_result("summary", cached is not None)
+    if cached is not None:
+        return output_structure(**cached)
+
+    async def create():
+        context, complete = await load_context()
+        response = await summarize(context)
+        if complete:
+            summary_cache.set(key, response.model_dump())
+        else:
+            logger.warning("Summary context incomplete, summary not cached")
+        return response
+
+    return await _summaries.do(key, create)
@@ -1,17 +1,14 @@
+from functools import cache
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List
+from utils.clients import chat_openai
+from utils.providers import provider
 
 load_dotenv()
 
-# Load Model
-model = ChatOpenAI(
-    model='gpt-5-nano'
-)
-
 # Create Output Schema
 class output_structure(BaseModel):
     summary: str = Field(
@@ -28,7 +25,10 @@ class output_structure(BaseModel):
 
 parser = PydanticOutputParser(pydantic_object=output_structure)
 
-structuredOutputModel = model.with_structured_output(output_structure)
+# Rendered when the first prompt is formatted, not at import
+@cache
+def format_instructions():
+    return parser.get_format_instructions()
 
 template = """
 You are a helpful assistant that analyzes the given context, produces a concise, accurate summary, and generates three relevant follow-up questions.
@@ -44,13 +44,43 @@ The following are some chucks of original document use them to summarize:
 prompt = PromptTemplate(
     template=template,
     input_variables=['context'],
-    partial_variables={"format_instructions": parser.get_format_instructions()}
+    partial_variables={"format_instructions": format_instructions}
 )
 
-chain = prompt | structuredOutputModel
+# Chains are built with the shared chat model on first use
+@provider("summary_chain")
+def chain():
+    return prompt | chat_openai().with_structured_output(output_structure)
+
+# Reduce step: combines summaries (of sources, or of parts of a large source) into one
+reduce_template = """
+You are a helpful assistant that combines the summaries of several sources (URL or DOCUMENT content, or parts of one) into one concise, accurate summary of all of them, and generates three relevant follow-up questions.
+Cover every source, do not favour the first ones. If there are no summaries, respond with a short note explaining that there is nothing to summarize yet.
+
+Format Instructions:
+{format_instructions}
+
+The following are the summaries to combine:
+{context}
+"""
+
+reduce_prompt = PromptTemplate(
+    template=reduce_template,
+    input_variables=['context'],
+    partial_variables={"format_instructions": format_instructions}
+)
+
+@provider("summary_reduce_chain")
+def reduce_chain():
+    return reduce_prompt | chat_openai().with_structured_output(output_structure)
 
 # Function to get structured reponse
-def getResponse(context):
-    return chain.invoke({
+async def getResponse(context):
+    return await chain().ainvoke({
+        'context': context
+    })
+
+async def getReduceResponse(context):
+    return await reduce_chain().ainvoke({
         'context': context
     })
\ No newline at end of file
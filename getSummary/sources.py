@@ -0,0 +1,140 @@
+import os
+import asyncio
+
+from utils.disk_cache import DiskCache
+from utils.singleflight import SingleFlight
+from utils.log import get_logger
+from utils.metrics import cache_result, timed
+from Pinecone_CRUD.SourceVersions import source_versions
+from .main import getResponse, getReduceResponse, output_structure
+
+logger = get_logger(__name__)
+
+# Words of text per map prompt, and LLM calls in flight for all map-reduce steps together
+SUMMARY_MAP_WORDS = int(os.getenv("SUMMARY_MAP_WORDS", "3000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_MAX_LEVELS = 4
+
+## --------------
+## PER SOURCE SUMMARIES
+## --------------
+# One summary per url/document of an index, built from all of its chunks when the source is
+# ingested and stored with the content version it was built from. The same docID in two
+# notebooks has two summaries. It is only rebuilt after the source changed.
+# Notebook summaries are a reduce step over these.
+source_summaries = DiskCache(
+    path=os.getenv("SUMMARY_CACHE_PATH", ".cache/summaries.sqlite3"),
+    table="source_summaries",
+    max_entries=int(os.getenv("SOURCE_SUMMARY_MAX_ENTRIES", "20000"))
+)
+
+_builds = SingleFlight()
+_llm_slots = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+# Keep references to background builds so they are not garbage collected
+_background_tasks = set()
+
+# Group texts into prompts of at most `max_words` words (a longer text gets its own prompt)
+def _pack(texts, max_words):
+    groups, current, words = [], [], 0
+    for text in texts:
+        size = len(text.split())
+        if current and words + size > max_words:
+            groups.append("\n\n".join(current))
+            current, words = [], 0
+        current.append(text)
+        words += size
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+async def _respond(respond, context):
+    async with _llm_slots:
+        with timed("summary_llm"):
+            return await respond(context)
+
+async def map_reduce(texts, respond=getResponse):
+    """
+    Summarize `texts` with one LLM call if they fit in one prompt. Otherwise summarize groups of
+    them in parallel and combine the partial summaries the same way until one is left.
+    `respond` is used for the first level, getReduceResponse for the levels above it.
+    """
+    for level in range(SUMMARY_MAX_LEVELS):
+        groups = _pack(texts, SUMMARY_MAP_WORDS)
+        if len(groups) <= 1:
+            return await _respond(respond, groups[0] if groups else "")
+
+        partials = await asyncio.gather(*[_respond(respond, group) for group in groups])
+        texts = [partial.summary for partial in partials]
+        respond = getReduceResponse
+
+    return await _respond(respond, "\n\n".join(texts))
+
+async def get_source_summary(indexID, source_type, source_id, load_texts):
+    """
+    (summary, complete) of one source for its current content version, summary is None when the
+    source has no text. `load_texts` is awaited for the chunks of the source (in document order)
+    and whether all of them could be read, on a miss. A summary of an incomplete read is returned
+    with complete False and not stored, the next request builds it again.
+    """
+    version = source_versions.get_many(indexID, [(source_type, source_id)])[(source_type, source_id)]
+    key = f"{indexID}:{source_type}:{source_id}"
+
+    cached = source_summaries.get(key)
+    hit = cached is not None and cached["version"] == version
+    cache_result("source_summary", hit)
+    if hit:
+        return (output_structure(**cached["summary"]) if cached["summary"] else None), True
+
+    async def build():
+        texts, complete = await load_texts()
+        texts = [text for text in texts if text and text.strip()]
+        response = await map_reduce(texts) if texts else None
+        if not complete:
+            logger.warning("Source texts incomplete, summary not cached", extra={"fields": {"source": source_id, "type": source_type}})
+            return response, False
+        source_summaries.set(key, {
+            "version": version,
+            "summary": response.model_dump() if response else None
+        })
+        return response, True
+
+    return await _builds.do(f"{key}:{version}", build)
+
+async def _build_in_background(indexID, source_type, source_id, load_texts):
+    try:
+        await get_source_summary(indexID, source_type, source_id, load_texts)
+    except Exception as e:
+        logger.exception("Failed to summarize source", extra={"fields": {"source": source_id, "type": source_type}})
+
+# Called after ingestion, so the summary is ready before anyone asks for it
+def schedule_source_summary(indexID, source_type, source_id, load_texts):
+    task = asyncio.create_task(_build_in_background(indexID, source_type, source_id, load_texts))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def drop_source_summary(indexID, source_type, source_id):
+    source_summaries.delete(f"{indexID}:{source_type}:{source_id}")
+
+## --------------
+## NOTEBOOK SUMMARIES
+## --------------
+# Summaries of all sources of a notebook, labelled and in request order, and whether all of them
+# were built from complete reads. Sources without text are left out.
+# `load_texts(source_type, source_id)` loads the chunks of a source without a summary.
+async def notebook_summary_texts(indexID, sources, load_texts):
+    summaries = await asyncio.gather(*[
+        get_source_summary(indexID, source_type, source_id, lambda source_type=source_type, source_id=source_id: load_texts(source_type, source_id))
+        for source_type, source_id in sources
+    ])
+
+    texts = [
+        f"{'URL' if source_type == 'url' else 'DOCUMENT'} {source_id}:\n{summary.summary}"
+        for (source_type, source_id), (summary, _) in zip(sources, summaries)
+        if summary
+    ]
+    return texts, all(complete for _, complete in summaries)
+
+# Reduce step of the notebook summary (hierarchical when the summaries do not fit in one prompt)
+async def reduce_summaries(texts):
+    return await map_reduce(texts, respond=getReduceResponse)
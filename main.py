@@ -1,63 +1,314 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
-from Quiz import extractor, generator
-from Pinecone_CRUD.main import create_index, upsert_document_data, upsert_url_content, delete_source, getContext, getSpecificContext
-from getSummary.main import getResponse
-from Chat.main import getChatResponse
+from contextlib import asynccontextmanager, aclosing
+import os
+import json
+import time
+import uuid
+import asyncio
+from utils.providers import startup_phase, startup_report
 
-app = FastAPI()
+# Every group of imports is timed, see GET /startup
+with startup_phase("import:fastapi"):
+    from fastapi import FastAPI, Request, HTTPException
+    from fastapi.responses import JSONResponse, PlainTextResponse
+    from sse_starlette.sse import EventSourceResponse
+with startup_phase("import:Quiz"):
+    from Quiz import extractor, generator, pool
+with startup_phase("import:Pinecone_CRUD"):
+    from Pinecone_CRUD.main import model as embedding_model, index_registry, job_queue, VECTOR_STORE
+    from Pinecone_CRUD.main import create_index, upsert_document_data, upsert_url_content, delete_source, get_source_texts
+    from Pinecone_CRUD.main import upsert_sources, delete_sources, invalid_source
+    from Pinecone_CRUD.Chunker import get_encoding
+with startup_phase("import:getSummary"):
+    from getSummary import main as summary, cache as summary_cache, sources as source_summaries
+with startup_phase("import:Chat"):
+    from Chat.main import getChatResponse, streamChatResponse, start_chat_agent, stop_chat_agent
+    from Chat import cache as chat_cache, memory as chat_memory
+from utils.log import get_logger, request_id
+from utils.metrics import render_metrics, http_requests, http_seconds
+from utils.blocking import run_blocking
+from utils.clients import openai_http, chat_openai, openai_embeddings, pinecone_client, close_clients
+from utils.limits import AdmissionGate, Overloaded, priority, INTERACTIVE, BULK
+
+logger = get_logger(__name__)
+
+# "sync" (default): upserts and deletes run inside the request. "queue": they are queued as
+# ingestion jobs and the endpoint returns a job id right away. A request can pick the mode with
+# {"async": true/false}.
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+
+# STARTUP_WARMUP=1: build every client, open the upstream connections and load the tokenizer
+# and prompts while starting, instead of in the first requests that need them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"
+
+# Requests of one endpoint running at once and waiting behind them, past that they get a 503.
+# Per endpoint overrides as "path=concurrency:queue,path=concurrency:queue".
+ENDPOINT_CONCURRENCY = int(os.getenv("ENDPOINT_CONCURRENCY", "64"))
+ENDPOINT_QUEUE = int(os.getenv("ENDPOINT_QUEUE", "128"))
+ENDPOINT_LIMITS = {
+    path.strip(): tuple(int(value) for value in limits.split(":"))
+    for path, limits in (
+        item.split("=") for item in os.getenv("ENDPOINT_LIMITS", "").split(",") if "=" in item
+    )
+}
+
+# Users are waiting on these, their upstream calls go ahead of ingestion
+INTERACTIVE_ENDPOINTS = {"/getAIResponse", "/getAIResponseStream", "/getSummary", "/getSummaryForEveryDoc", "/generateQuiz"}
+BULK_ENDPOINTS = {"/upsert_documents", "/upsert_url_info", "/delete_documents", "/delete_url_info", "/upsert_sources", "/delete_sources"}
+
+async def _preconnect_openai():
+    await run_blocking(chat_openai)
+    await run_blocking(openai_embeddings)
+    # Any response will do, it leaves an open connection in the pool
+    await openai_http()["async"].get(
+        os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1") + "/models",
+        headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+    )
+
+async def _preconnect_pinecone():
+    if VECTOR_STORE != "local":
+        await run_blocking(lambda: pinecone_client().list_indexes())
+
+async def _prepare_prompts():
+    await run_blocking(lambda: (
+        summary.chain(), summary.reduce_chain(), summary.format_instructions(),
+        generator.chain(), generator.parallel_chain(), generator.format_instructions()
+    ))
+
+async def _warm(name, step):
+    try:
+        with startup_phase(f"warmup:{name}"):
+            await step()
+    except Exception as e:
+        # Not fatal, the first request that needs it tries again
+        logger.warning("Warmup step failed", extra={"fields": {"step": name, "error": repr(e)}})
+
+async def warmup():
+    with startup_phase("warmup"):
+        await asyncio.gather(
+            _warm("openai", _preconnect_openai),
+            _warm("pinecone", _preconnect_pinecone),
+            _warm("tokenizer", lambda: run_blocking(get_encoding)),
+            _warm("prompts", _prepare_prompts),
+            _warm("youtube", lambda: run_blocking(extractor.ytt_api))
+        )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fetch MCP tools and compile the chat workflow once for all requests
+    with startup_phase("lifespan:chat_agent"):
+        await start_chat_agent()
+    # Ingestion job workers (also picks up jobs interrupted by the last shutdown)
+    with startup_phase("lifespan:job_queue"):
+        await job_queue.start()
+    if STARTUP_WARMUP:
+        await warmup()
+    logger.info("Startup finished", extra={"fields": startup_report()})
+    yield
+    await job_queue.stop()
+    await stop_chat_agent()
+    # Close pooled pinecone connections on shutdown
+    await index_registry.close()
+    await close_clients()
+
+app = FastAPI(lifespan=lifespan)
+
+def _overloaded_response(error):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{error.name} is overloaded, try again later"},
+        headers={"Retry-After": str(max(1, round(error.retry_after)))}
+    )
+
+# An upstream (model, index) still throttling after all retries
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, error: Overloaded):
+    return _overloaded_response(error)
+
+## --------------
+## ADMISSION CONTROL
+## --------------
+# Every interactive and ingestion endpoint has a concurrency cap and a bounded queue (see
+# utils.limits.AdmissionGate), a request that finds the queue full is shed with a 503 and a
+# Retry-After right away. The slot is held until the response is fully sent, so a streamed chat
+# answer counts for as long as it streams. Plain ASGI, not @app.middleware, for that reason.
+gates = {
+    path: AdmissionGate(path, *ENDPOINT_LIMITS.get(path, (ENDPOINT_CONCURRENCY, ENDPOINT_QUEUE)))
+    for path in INTERACTIVE_ENDPOINTS | BULK_ENDPOINTS
+}
+
+class AdmissionControl:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        gate = gates.get(scope["path"]) if scope["type"] == "http" else None
+        if gate is None:
+            return await self.app(scope, receive, send)
+
+        token = priority.set(INTERACTIVE if scope["path"] in INTERACTIVE_ENDPOINTS else BULK)
+        try:
+            try:
+                await gate.enter()
+            except Overloaded as e:
+                logger.warning("Request shed", extra={"fields": {"path": scope["path"], "running": gate.running}})
+                return await _overloaded_response(e)(scope, receive, send)
+
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                gate.leave()
+        finally:
+            priority.reset(token)
+
+# Added before observe_request so that one stays outermost and also sees the shed requests
+app.add_middleware(AdmissionControl)
+
+# Tag every request with an id (taken from X-Request-ID when the caller sends one) so all log
+# lines it produces can be correlated, and record its latency.
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    rid = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id.set(rid)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = rid
+        return response
+    except Exception:
+        logger.exception("Request failed")
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        path = request.url.path
+        # Labelled by route template, raw paths (job ids, unknown urls) would add a series each
+        route = request.scope.get("route")
+        if route is not None:
+            label = route.path
+        else:
+            # Shed before routing, or no route at all
+            label = path if path in gates else "unmatched"
+        http_seconds.observe(elapsed, method=request.method, path=label)
+        http_requests.inc(method=request.method, path=label, status=status)
+        logger.info("Request finished", extra={"fields": {
+            "method": request.method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 1)
+        }})
+        request_id.reset(token)
 
 @app.get("/")
 def home():
     return "Home"
 
+# Per-stage latencies, token usage and cache hit rates in the Prometheus text format
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Time spent importing, creating clients and starting up (ms per phase)
+@app.get("/startup")
+async def startup():
+    return startup_report()
+
+# Hit and miss counters of the embedding cache
+@app.get("/embedding_cache_stats")
+def embeddingCacheStats():
+    return embedding_model.stats()
+
 @app.post('/generateQuiz')
 async def GenerateQuize(request: Request):
     data = await request.json()
     
-    # Get Video ID & Transcript
+    # Get Video ID
     video_id = extractor.getID(url=data['youtubeURLLink'])
-    transcript = extractor.get_transript(video_id=video_id)
 
-    # Generate Quiz
-    print(f"Quiz generating of the video: {video_id}")
-    quizzes = generator.generate_quiz(transcript)
+    # Sample from the video's quiz pool or generate (count, concurrency, timeout and mode are optional)
+    try:
+        count = int(data.get('count', generator.QUIZ_COUNT))
+        concurrency = int(data.get('concurrency', generator.QUIZ_CONCURRENCY))
+        timeout = float(data.get('timeout', generator.QUIZ_TIMEOUT))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="count, concurrency and timeout must be numbers")
+    if count < 1 or concurrency < 1 or timeout <= 0:
+        raise HTTPException(status_code=400, detail="count and concurrency must be at least 1 and timeout positive")
+
+    logger.info("Generating quiz", extra={"fields": {"video_id": video_id}})
+    quizzes = await pool.get_quizzes(
+        video_id,
+        count=count,
+        concurrency=concurrency,
+        timeout=timeout,
+        mode=data.get('mode', 'parallel')
+    )
 
     return {
         'success': True,
         'message': quizzes
     }
 
+## --------------
+## INGESTION JOBS
+## --------------
+def _queued(data):
+    return bool(data.get('async', INGEST_MODE == 'queue'))
+
+async def _enqueue(kind, payload):
+    job_id = await job_queue.submit(kind, payload['indexID'], payload)
+    return JSONResponse(
+        status_code=202,
+        content={'jobID': job_id, 'status': 'queued', 'message': 'Job queued'}
+    )
+
+# Status, progress (chunks embedded/upserted) and the final result of a queued job
+@app.get('/ingestion_jobs/{job_id}')
+async def ingestionJobStatus(job_id: str):
+    job = await job_queue.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # verified
 @app.post('/upsert_documents')
 async def UpsertDocuments(request: Request):
     data = await request.json()
+
+    if _queued(data):
+        return await _enqueue('upsert_documents', {'indexID': data['indexID'], 'docs': data['docs'], 'docID': data['docID']})
     
     # Create INDEX if not exist
-    INDEX = create_index(data['indexID'])
+    INDEX = await create_index(data['indexID'])
 
     # Upsert Documents At Pinecone
-    upsertedOrNot = upsert_document_data(
+    upsertedOrNot = await upsert_document_data(
         docs=data['docs'], 
         DOCID=data['docID'], 
-        index=INDEX
+        index=INDEX,
+        indexID=data['indexID']
     )
 
-    return {'message': upsertedOrNot}
+    # Report has the message plus counts of written, skipped and failed vectors
+    return upsertedOrNot
 
 # verified
 @app.post('/delete_documents')
 async def deleteDocuments(request: Request):
     data = await request.json()
+
+    if _queued(data):
+        return await _enqueue('delete_source', {'indexID': data['indexID'], 'docID': data['docID'], 'docType': 'doc'})
     
     # Create INDEX if not exist
-    INDEX = create_index(data['indexID'])
+    INDEX = await create_index(data['indexID'])
 
     # Upsert Documents At Pinecone
-    deletedOrNot = delete_source(
+    deletedOrNot = await delete_source(
         index=INDEX,
         docid=data['docID'],
-        docType='doc'
+        docType='doc',
+        indexID=data['indexID']
     )
 
     return {'message': deletedOrNot}
@@ -66,50 +317,185 @@ async def deleteDocuments(request: Request):
 @app.post('/upsert_url_info')
 async def upsert_url_info(request: Request):
     data = await request.json()
+
+    if _queued(data):
+        return await _enqueue('upsert_url', {'indexID': data['indexID'], 'url': data['url'], 'docID': data['docID']})
     
     # Create Index If Not Exist
-    INDEX = create_index(data['indexID'])
-    
+    INDEX = await create_index(data['indexID'])
+
     # Upsert Contect to Pinecone
-    upsertedOrNot = upsert_url_content(
+    upsertedOrNot = await upsert_url_content(
         url=data['url'], 
         index=INDEX, 
-        docID=data['docID']
+        docID=data['docID'],
+        indexID=data['indexID']
     )
 
-    return {'message': upsertedOrNot}
+    # Report has the message plus counts of written, skipped and failed vectors
+    return upsertedOrNot
 
 # verified
 @app.post('/delete_url_info')
 async def deleteUrls(request: Request):
     data = await request.json()
+
+    if _queued(data):
+        return await _enqueue('delete_source', {'indexID': data['indexID'], 'docID': data['urlID'], 'docType': 'url'})
     
     # Create INDEX if not exist
-    INDEX = create_index(data['indexID'])
+    INDEX = await create_index(data['indexID'])
 
     # Upsert Documents At Pinecone
-    deletedOrNot = delete_source(
+    deletedOrNot = await delete_source(
         index=INDEX,
         docid=data['urlID'],
-        docType='url'
+        docType='url',
+        indexID=data['indexID']
     )
 
     return {'message': deletedOrNot}
 
+## --------------
+## BULK INGESTION
+## --------------
+# Many sources of one index per call, either as JSON
+#   {"indexID": ..., "sources": [{"type": "doc", "docID": ..., "docs": [...]}, {"type": "url", "docID": ..., "url": ...}]}
+# or as NDJSON (Content-Type application/x-ndjson) with one source record per line and
+# indexID (and async) in the query string. An NDJSON body is read line by line: a large document
+# can be split over consecutive lines with the same docID, and the first sources are embedded
+# while the rest is still uploading. The answer has one result per source, in request order.
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+
+async def _json_records(sources):
+    for number, record in enumerate(sources, 1):
+        yield record if isinstance(record, dict) else {"error": f"source {number} is not an object"}
+
+async def _ndjson_records(request):
+    number = 0
+    pending = []
+
+    def parse(line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return {"error": f"line {number} is not valid JSON"}
+        return record if isinstance(record, dict) else {"error": f"line {number} is not an object"}
+
+    async for data in request.stream():
+        *lines, rest = data.split(b"\n")
+        if lines:
+            lines[0] = b"".join(pending) + lines[0]
+            pending = []
+        pending.append(rest)
+
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield parse(line)
+
+    line = b"".join(pending)
+    number += 1
+    if line.strip():
+        yield parse(line)
+
+async def _bulk_request(request):
+    if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_TYPES:
+        data = {"indexID": request.query_params.get("indexID")}
+        if "async" in request.query_params:
+            data["async"] = request.query_params["async"] in ("1", "true")
+        records = _ndjson_records(request)
+    else:
+        data = await request.json()
+        if not isinstance(data, dict) or not isinstance(data.get("sources", []), list):
+            raise HTTPException(status_code=400, detail="sources must be a list of source objects")
+        records = _json_records(data.get("sources", []))
+
+    if not data.get("indexID"):
+        raise HTTPException(status_code=400, detail="indexID is required")
+    return data, records
+
+# Queue mode: one ingestion job per source (the records of a streamed document are joined)
+async def _enqueue_sources(records, indexID, deleting):
+    results = []
+    document = None
+    # Same rule as a synchronous upsert: a document split over records that are not consecutive
+    # would be replaced by its later records only
+    seen = set()
+
+    async def submit(kind, source_type, payload):
+        job_id = await job_queue.submit(kind, indexID, payload)
+        results.append({"type": source_type, "docID": payload["docID"], "jobID": job_id, "status": "queued"})
+
+    async def flush():
+        nonlocal document
+        if document is not None:
+            await submit("upsert_documents", 'doc', document)
+            document = None
+
+    async for record in records:
+        error = invalid_source(record, deleting=deleting)
+        if error is None and not deleting and document is not None and record["type"] == 'doc' and record["docID"] == document["docID"]:
+            document["docs"].extend(record.get("docs") or [])
+            continue
+
+        await flush()
+        if error is None and not deleting:
+            if (record["type"], record["docID"]) in seen:
+                error = "source sent twice, all records of a source must be consecutive"
+            seen.add((record["type"], record["docID"]))
+        if error is not None:
+            results.append({"type": record.get("type"), "docID": record.get("docID"), "error": error})
+        elif deleting:
+            await submit("delete_source", record["type"], {"indexID": indexID, "docID": record["docID"], "docType": record["type"]})
+        elif record["type"] == 'url':
+            await submit("upsert_url", 'url', {"indexID": indexID, "url": record["url"], "docID": record["docID"]})
+        else:
+            document = {"indexID": indexID, "docs": list(record.get("docs") or []), "docID": record["docID"]}
+    await flush()
+
+    return JSONResponse(status_code=202, content={"results": results, "message": "Jobs queued"})
+
+@app.post('/upsert_sources')
+async def upsertSources(request: Request):
+    data, records = await _bulk_request(request)
+
+    if _queued(data):
+        return await _enqueue_sources(records, data['indexID'], deleting=False)
+
+    INDEX = await create_index(data['indexID'])
+    return {"results": await upsert_sources(records, INDEX, indexID=data['indexID'])}
+
+@app.post('/delete_sources')
+async def deleteSources(request: Request):
+    data, records = await _bulk_request(request)
+
+    if _queued(data):
+        return await _enqueue_sources(records, data['indexID'], deleting=True)
+
+    INDEX = await create_index(data['indexID'])
+    return {"results": await delete_sources(records, INDEX, indexID=data['indexID'])}
+
 # varified
 @app.post("/getSummary")
 async def getSummary(request: Request):
     data = await request.json()
-    
-    # Fetch context from pinecone database
-    context = getContext(
-        indexID=data['indexID'], 
-        allurlIDs=data['allurlsID'], 
-        alldocIDs=data['alldocsID'] 
-    )
 
-    # Feed context to model and get response
-    response = getResponse(context)
+    sources = [('url', urlID) for urlID in (data['allurlsID'] or [])] + [('doc', docID) for docID in (data['alldocsID'] or [])]
+
+    # Cached per (index, sources, source versions), any upsert/delete of a source invalidates it
+    key = summary_cache.summary_key('notebook', data['indexID'], sources)
+
+    # Per source summaries (built at ingestion, only missing ones are built here)
+    async def load_context():
+        return await source_summaries.notebook_summary_texts(
+            data['indexID'],
+            sources,
+            lambda source_type, source_id: get_source_texts(data['indexID'], source_type, source_id)
+        )
+
+    # Reduce them into the notebook summary
+    response = await summary_cache.get_summary(key, load_context, summarize=source_summaries.reduce_summaries)
 
     # Send response to client
     return {
@@ -122,15 +508,19 @@ async def getSummary(request: Request):
 @app.post("/getSummaryForEveryDoc")
 async def getSummaryForEveryDoc(request: Request):
     data = await request.json()
-    
-    context = getSpecificContext(
-        sourceType = data["sourceType"],
-        sourceID = data["sourceID"],
-        indexID = data["indexID"]
+
+    source_type = 'url' if data["sourceType"] == "URL" else 'doc'
+
+    # Summary of the whole source, usually built when it was ingested
+    response, _ = await source_summaries.get_source_summary(
+        data["indexID"],
+        source_type,
+        data["sourceID"],
+        lambda: get_source_texts(data["indexID"], source_type, data["sourceID"])
     )
 
-    # Feed context to model and get response
-    response = getResponse(context)
+    if response is None:
+        return {"summary": "There is no content to summarize for this source yet.", "success": True}
     
     return {"summary": response.summary, "success": True}
 
@@ -165,17 +555,87 @@ async def getAIResponse(request: Request):
     userID = data.get("userID", "")
     notebookID = data.get("notebookID", "")
     
+    # {"serverMemory": true} keeps the conversation on the server (per userID and notebookID)
+    # instead of taking it from pastConverstation
+    remembered = bool(data.get("serverMemory", False))
+    if remembered:
+        pastConverstation = await chat_memory.history(userID, notebookID)
+
     # Invoke our chatbot asynchronously
-    response = await getChatResponse(
-        query=user_query,
-        past_conversation=pastConverstation,
-        userID=userID,
-        notebookID=notebookID
-    )
+    async def respond():
+        response = await getChatResponse(
+            query=user_query,
+            past_conversation=pastConverstation,
+            userID=userID,
+            notebookID=notebookID
+        )
+        return response['messages'][-1].content
+
+    # Only opening questions are cached, follow-ups depend on the conversation.
+    # {"noCache": true} always asks the agent.
+    if pastConverstation:
+        answer = await respond()
+    else:
+        answer = await chat_cache.cached_answer(notebookID, user_query, respond, bypass=data.get("noCache", False))
+
+    if remembered:
+        await chat_memory.remember(userID, notebookID, user_query, answer)
 
     # return response
-    return {"response": response['messages'][-1].content}
+    return {"response": answer}
+
+@app.post("/getAIResponseStream")
+async def getAIResponseStream(request: Request):
+    """
+    Streaming variant of /getAIResponse. Takes the same inputs and sends Server-Sent Events:
+        - tool_start / tool_end while tools are running
+        - token for every piece of the final answer
+        - done with the full response, ttft_ms and total_ms
+
+    If the client disconnects, the running model and tool calls are cancelled.
+    """
+    data = await request.json()
+    
+    if not data:
+        raise HTTPException(status_code=400, detail="No JSON received")
+
+    query = data.get("query", "")
+    pastConverstation = data.get("pastConverstation", "")
+    userID = data.get("userID", "")
+    notebookID = data.get("notebookID", "")
+
+    # Same opt-in server side conversation memory as /getAIResponse
+    remembered = bool(data.get("serverMemory", False))
+    if remembered:
+        pastConverstation = await chat_memory.history(userID, notebookID)
+
+    async def events():
+        stream = streamChatResponse(
+            query=query,
+            past_conversation=pastConverstation,
+            userID=userID,
+            notebookID=notebookID
+        )
+
+        # aclosing makes sure the workflow is stopped as soon as we stop reading from it
+        async with aclosing(stream):
+            async for event in stream:
+                if await request.is_disconnected():
+                    break
+                # Only complete answers are remembered
+                if event["event"] == "done" and remembered:
+                    await chat_memory.remember(userID, notebookID, query, event["data"]["response"])
+                yield {"event": event["event"], "data": json.dumps(event["data"])}
+
+    return EventSourceResponse(events())
+
+# Start a new conversation: forget the server side history of (userID, notebookID)
+@app.post("/clearConversation")
+async def clearConversation(request: Request):
+    data = await request.json()
 
+    await run_blocking(chat_memory.conversation_memory.clear, data["userID"], data["notebookID"])
+    return {"success": True}
 
 if __name__ == "__main__":
     import uvicorn
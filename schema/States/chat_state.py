@@ -6,4 +6,5 @@ class ChatState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
     pastConversations: List
     UserID: str
-    notebookID: str
\ No newline at end of file
+    notebookID: str
+    startedAt: float
\ No newline at end of file
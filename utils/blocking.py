@@ -0,0 +1,41 @@
+import os
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# A small bounded thread pool for the calls which can only block (pinecone control plane,
+# youtube transcripts, web page loading). Keeping it bounded means a burst of slow calls
+# queues here instead of spawning threads without limit.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "8"))
+
+executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_POOL_SIZE,
+    thread_name_prefix="blocking"
+)
+
+# Run a blocking function on the shared pool without blocking the event loop.
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        functools.partial(func, *args, **kwargs)
+    )
+
+# Iterate the (blocking) iterable returned by func(*args) on the shared pool, `batch_size` items
+# per hop, e.g. a generator that loads and splits a page.
+async def iterate_blocking(func, *args, batch_size=64):
+    iterator = None
+
+    def take():
+        nonlocal iterator
+        if iterator is None:
+            iterator = iter(func(*args))
+        return list(itertools.islice(iterator, batch_size))
+
+    while True:
+        items = await run_blocking(take)
+        if not items:
+            return
+        for item in items:
+            yield item
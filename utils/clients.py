@@ -0,0 +1,134 @@
+import os
+
+from utils.providers import provider
+from utils.metrics import metrics_callback
+from utils.limits import limiter, call_with_retries, back_off
+
+# Connections kept open to the OpenAI API, shared by every chat model and embedding client
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "100"))
+
+CHAT_MODEL = "gpt-5-nano"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Tokens budgeted for the answer of a chat call, on top of the prompt
+CHAT_COMPLETION_TOKENS = int(os.getenv("CHAT_COMPLETION_TOKENS", "500"))
+
+# Rough token count for the rate limiter (~4 characters per token), tiktoken is too slow here
+def _estimate_tokens(texts):
+    return sum(len(str(text)) for text in texts) // 4
+
+## --------------
+## SHARED UPSTREAM CLIENTS
+## --------------
+# One instance (and so one HTTP connection pool) per upstream for the whole process, created on
+# first use. The chat agent, summaries and quizzes all use the same chat model, ingestion and
+# quiz deduplication the same embedding client. Calls go through the shared limiter of their
+# model (OPENAI_CHAT_RPM/TPM, OPENAI_EMBEDDING_RPM/TPM) and utils.limits retries them, so the SDK
+# retries are off.
+@provider("openai_http")
+def openai_http():
+    import httpx
+    from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
+
+    limits = httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE)
+    return {
+        "sync": DefaultHttpxClient(limits=limits),
+        "async": DefaultAsyncHttpxClient(limits=limits)
+    }
+
+@provider("chat_openai")
+def chat_openai():
+    from langchain_openai import ChatOpenAI
+
+    class LimitedChatOpenAI(ChatOpenAI):
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            return await call_with_retries(
+                lambda: super(LimitedChatOpenAI, self)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                limiter=_chat_limiter(),
+                tokens=_prompt_tokens(messages)
+            )
+
+        # Retried only until the first chunk, a half streamed answer can not be taken back
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            attempt = 0
+            while True:
+                await _chat_limiter().acquire(_prompt_tokens(messages))
+                started = False
+                try:
+                    async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    if started:
+                        raise
+                    await back_off(e, attempt, _chat_limiter())
+                    attempt += 1
+
+    return LimitedChatOpenAI(
+        model=CHAT_MODEL,
+        max_retries=0,
+        callbacks=[metrics_callback],
+        http_client=openai_http()["sync"],
+        http_async_client=openai_http()["async"]
+    )
+
+@provider("openai_embeddings")
+def openai_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        max_retries=0,
+        http_client=openai_http()["sync"],
+        http_async_client=openai_http()["async"]
+    )
+
+@provider("pinecone")
+def pinecone_client():
+    from pinecone import Pinecone
+
+    api_key = os.getenv("PINECONE_API_KEY")
+    if not api_key:
+        raise RuntimeError("PINECONE_API_KEY is not set")
+    return Pinecone(api_key=api_key)
+
+def _chat_limiter():
+    return limiter(f"openai:{CHAT_MODEL}", "OPENAI_CHAT")
+
+def _prompt_tokens(messages):
+    return _estimate_tokens(message.content for message in messages) + CHAT_COMPLETION_TOKENS
+
+def _embedding_limiter():
+    return limiter(f"openai:{EMBEDDING_MODEL}", "OPENAI_EMBEDDING")
+
+# Embeddings interface in front of `openai_embeddings`, so CachedEmbeddings and the batcher can
+# be set up at import without building the client
+class LazyEmbeddings:
+    model = EMBEDDING_MODEL
+    dimensions = None
+
+    async def aembed_documents(self, texts):
+        return await call_with_retries(
+            lambda: openai_embeddings().aembed_documents(texts),
+            limiter=_embedding_limiter(),
+            tokens=_estimate_tokens(texts)
+        )
+
+    async def aembed_query(self, text):
+        return await call_with_retries(
+            lambda: openai_embeddings().aembed_query(text),
+            limiter=_embedding_limiter(),
+            tokens=_estimate_tokens([text])
+        )
+
+    def embed_documents(self, texts):
+        return openai_embeddings().embed_documents(texts)
+
+    def embed_query(self, text):
+        return openai_embeddings().embed_query(text)
+
+# Called on shutdown, only closes what was created
+async def close_clients():
+    if openai_http.created:
+        openai_http()["sync"].close()
+        await openai_http()["async"].aclose()
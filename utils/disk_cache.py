@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Reads do not commit: the last_used times of read entries are written with the next write, or
+# at most every LAST_USED_FLUSH_SECONDS by a read. A commit is an fsync, and lookups run on the
+# event loop.
+LAST_USED_FLUSH_SECONDS = float(os.getenv("CACHE_LAST_USED_FLUSH_SECONDS", "30"))
+
+## --------------
+## DISK CACHE
+## --------------
+# A small key/value cache persisted in a local sqlite file. Values are stored as JSON.
+# Entries expire after `ttl` seconds (None = never) and the least recently used entries are
+# dropped once there are more than `max_entries` of them.
+class DiskCache:
+    def __init__(self, path, table, ttl=None, max_entries=1000):
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # key -> last_used not written yet
+        self._touched = {}
+        self._flushed_at = time.monotonic()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table}(last_used)")
+        self._db.commit()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                return default
+
+            value, expires_at = row
+            now = time.time()
+            if expires_at is not None and expires_at < now:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._db.commit()
+                return default
+
+            self._touched[key] = now
+            if time.monotonic() - self._flushed_at > LAST_USED_FLUSH_SECONDS:
+                self._flush_touched()
+                self._db.commit()
+            return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl else None, now)
+            )
+            self._touched.pop(key, None)
+            self._flush_touched()
+            self._evict(now)
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._touched.pop(key, None)
+            self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._db.commit()
+
+    # Caller holds the lock and commits
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                f"UPDATE {self.table} SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+        self._flushed_at = time.monotonic()
+
+    def _evict(self, now):
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?",
+            (now,)
+        )
+
+        count = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
@@ -0,0 +1,277 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import contextvars
+from email.utils import parsedate_to_datetime
+
+from utils.log import get_logger
+from utils.metrics import counter, stage_seconds
+
+logger = get_logger(__name__)
+
+# Retries of a throttled or failing upstream call, and the backoff between them (seconds)
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "4"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "30"))
+
+throttled = counter("upstream_throttled_total", "Upstream calls that were throttled or failed and retried, by upstream and status")
+shed = counter("requests_shed_total", "Requests rejected with 503 because the endpoint queue was full, by endpoint")
+
+## --------------
+## PRIORITY CLASSES
+## --------------
+# Lower goes first. Interactive endpoints set it for their request; everything else (ingestion,
+# jobs, background summaries) runs as bulk and waits behind them for upstream capacity.
+INTERACTIVE = 0
+BULK = 1
+
+priority = contextvars.ContextVar("priority", default=BULK)
+
+class Overloaded(Exception):
+    """The queue in front of a resource is full, the request should be retried later."""
+    def __init__(self, name, retry_after=1):
+        super().__init__(f"{name} is overloaded")
+        self.name = name
+        self.retry_after = retry_after
+
+## --------------
+## RATE LIMITER
+## --------------
+# Requests per minute and tokens per minute of one upstream (a model or an index), as two token
+# buckets that refill continuously. Callers wait in priority order until both budgets cover
+# their call. A Retry-After from the upstream pauses every caller of that limiter. 0 means no
+# limit for that budget.
+class RateLimiter:
+    def __init__(self, name, rpm=0, tpm=0):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+        # (priority, seq, tokens, future)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    # Seconds until a call of `tokens` tokens fits in the budgets
+    def _wait_time(self, tokens):
+        waits = [self._paused_until - time.monotonic()]
+        if self.rpm and self._requests < 1:
+            waits.append((1 - self._requests) * 60 / self.rpm)
+        if self.tpm and self._tokens < tokens:
+            waits.append((tokens - self._tokens) * 60 / self.tpm)
+        return max(waits)
+
+    def _take(self, tokens):
+        if self.rpm:
+            self._requests -= 1
+        if self.tpm:
+            self._tokens -= tokens
+
+    def _grant(self):
+        self._timer = None
+        self._refill()
+
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._grant)
+                return
+
+            heapq.heappop(self._waiters)
+            self._take(tokens)
+            future.set_result(None)
+
+    async def acquire(self, tokens=0):
+        if not self.rpm and not self.tpm and self._paused_until <= time.monotonic():
+            return
+
+        # A call larger than the whole budget would never fit
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+
+        self._refill()
+        if not self._waiters and self._wait_time(tokens) <= 0:
+            self._take(tokens)
+            return
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority.get(), next(self._seq), tokens, future))
+        if self._timer is None:
+            self._grant()
+
+        await future
+        stage_seconds.observe(time.perf_counter() - started, stage="rate_limit_wait", upstream=self.name)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._waiters:
+            self._timer = asyncio.get_running_loop().call_later(seconds, self._grant)
+
+_limiters = {}
+
+def _budget(prefix, suffix):
+    return int(os.getenv(f"{prefix}_{suffix}", "0"))
+
+# Shared limiter per upstream. Budgets come from {env_prefix}_RPM / {env_prefix}_TPM.
+def limiter(name, env_prefix):
+    if name not in _limiters:
+        _limiters[name] = RateLimiter(name, rpm=_budget(env_prefix, "RPM"), tpm=_budget(env_prefix, "TPM"))
+    return _limiters[name]
+
+## --------------
+## RETRIES
+## --------------
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Still failing with these after the last retry: the upstream is overloaded, not broken
+OVERLOAD_STATUSES = {429, 503}
+
+# HTTP status of an OpenAI (status_code) or Pinecone (status) error, None for other errors
+def _status(error):
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status if isinstance(status, int) else None
+
+def _retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    # openai.APIConnectionError / APITimeoutError carry no status
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    return _status(error) in RETRY_STATUSES
+
+def _headers(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    return headers or {}
+
+# Seconds the upstream asked us to wait (Retry-After / retry-after-ms), None when it did not say
+def retry_after(error):
+    headers = _headers(error)
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+# Full jitter exponential backoff
+def backoff_delay(attempt, base=UPSTREAM_BACKOFF_BASE, cap=UPSTREAM_BACKOFF_MAX):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+async def call_with_retries(func, limiter=None, tokens=0, max_retries=UPSTREAM_MAX_RETRIES):
+    """
+    Await `func()` within the budgets of `limiter`. Throttling, timeouts and 5xx errors are
+    retried after the upstream's Retry-After or a jittered exponential backoff, other errors are
+    raised right away.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire(tokens)
+        try:
+            return await func()
+        except Exception as e:
+            await back_off(e, attempt, limiter, max_retries)
+
+async def back_off(error, attempt, limiter=None, max_retries=UPSTREAM_MAX_RETRIES):
+    """Wait before retrying after `error`, or raise when it should not (or can no longer) be retried."""
+    name = limiter.name if limiter is not None else "upstream"
+    if not _retryable(error):
+        raise error
+
+    asked = retry_after(error)
+    if attempt >= max_retries:
+        if _status(error) in OVERLOAD_STATUSES:
+            raise Overloaded(name, retry_after=asked or 1) from error
+        raise error
+
+    delay = asked if asked is not None else backoff_delay(attempt)
+    # Everyone using this upstream backs off, not just this call
+    if asked is not None and limiter is not None:
+        limiter.pause(asked)
+
+    throttled.inc(upstream=name, status=_status(error) or type(error).__name__)
+    logger.warning("Upstream call failed, retrying", extra={"fields": {
+        "upstream": name,
+        "attempt": attempt + 1,
+        "delay": round(delay, 2),
+        "error": str(error)
+    }})
+    await asyncio.sleep(delay)
+
+## --------------
+## ADMISSION CONTROL
+## --------------
+# At most `concurrency` requests of an endpoint run at once, up to `max_queue` more wait in
+# priority order. Past that the request is shed with Overloaded (a 503 for the client) instead
+# of piling up.
+class AdmissionGate:
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+
+        self.running = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    async def enter(self):
+        if self.running < self.concurrency and not self._waiters:
+            self.running += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            shed.inc(endpoint=self.name)
+            raise Overloaded(self.name)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority.get(), next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Got the slot just as we were cancelled, hand it on
+                self.leave()
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def leave(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # The slot goes straight to the next waiter
+                future.set_result(None)
+                return
+        self.running -= 1
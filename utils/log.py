@@ -0,0 +1,42 @@
+import os
+import json
+import time
+import logging
+import contextvars
+
+## --------------
+## STRUCTURED LOGS
+## --------------
+# JSON lines with the id of the request they belong to. The id is set once per request by the
+# middleware in main.py and follows the request into every coroutine and background task.
+
+request_id = contextvars.ContextVar("request_id", default="-")
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(time.time(), 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": request_id.get(),
+            "message": record.getMessage()
+        }
+
+        # Anything passed as logger.info(..., extra={"fields": {...}})
+        entry.update(getattr(record, "fields", {}))
+
+        if record.exc_info:
+            entry["error"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+_handler = logging.StreamHandler()
+_handler.setFormatter(JSONFormatter())
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(_handler)
+        logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+        logger.propagate = False
+    return logger
@@ -0,0 +1,176 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+## --------------
+## METRICS
+## --------------
+# A tiny in-process metrics registry rendered in the Prometheus text format on /metrics.
+# Counters and histograms support labels, everything is guarded by one lock since metrics are
+# also recorded from the blocking thread pool.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_metrics = {}
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with _lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = []
+        for key, entry in self._values.items():
+            for bound, count in zip(self.buckets, entry):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {entry[-1]}")
+        return lines
+
+def counter(name, description):
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = Counter(name, description)
+        return _metrics[name]
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = Histogram(name, description, buckets)
+        return _metrics[name]
+
+def render_metrics():
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+## --------------
+## SHARED PIPELINE METRICS
+## --------------
+stage_seconds = histogram(
+    "pipeline_stage_duration_seconds",
+    "Duration of each pipeline stage (chunking, embedding, upsert, query, llm, mcp_tool, transcript_fetch, ...)"
+)
+llm_tokens = counter("llm_tokens_total", "LLM tokens used, by model and kind (prompt/completion)")
+embedded_texts = counter("embedding_texts_total", "Texts sent to the embedding model")
+vector_counts = counter("vectors_total", "Vectors handled by ingestion and deletes, by result (written/skipped/failed/deleted)")
+cache_requests = counter("cache_requests_total", "Cache lookups, by cache and result (hit/miss)")
+http_requests = counter("http_requests_total", "HTTP requests, by method, path and status")
+http_seconds = histogram("http_request_duration_seconds", "HTTP request latency, by method and path")
+
+# Time a block of code as one pipeline stage (works in sync and async code)
+@contextmanager
+def timed(stage, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage, **labels)
+
+def cache_result(cache, hit, amount=1):
+    if amount:
+        cache_requests.inc(amount, cache=cache, result="hit" if hit else "miss")
+
+## --------------
+## LANGCHAIN CALLBACKS
+## --------------
+# Records LLM latency and token usage and MCP tool call latency. Attach it to the chat models
+# (`callbacks=[metrics_callback]`) and to workflow runs (`config={"callbacks": [...]}`).
+class MetricsCallbackHandler(BaseCallbackHandler):
+    def __init__(self):
+        self._started = {}
+
+    def _start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+
+    def _finish(self, run_id, stage, **labels):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            stage_seconds.observe(time.perf_counter() - started, stage=stage, **labels)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model = (response.llm_output or {}).get("model_name", "unknown")
+        self._finish(run_id, "llm", model=model)
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    llm_tokens.inc(usage.get("input_tokens", 0), model=model, kind="prompt")
+                    llm_tokens.inc(usage.get("output_tokens", 0), model=model, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "llm", model="error")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_tool_end(self, output, *, run_id, name=None, **kwargs):
+        self._finish(run_id, "mcp_tool", tool=name or "unknown")
+
+    def on_tool_error(self, error, *, run_id, name=None, **kwargs):
+        self._finish(run_id, "mcp_tool", tool=name or "unknown")
+
+metrics_callback = MetricsCallbackHandler()
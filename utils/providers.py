@@ -0,0 +1,64 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from utils.log import get_logger
+from utils.metrics import stage_seconds
+
+logger = get_logger(__name__)
+
+## --------------
+## STARTUP TIMINGS
+## --------------
+# How long the imports, client creation and lifespan steps took, in the order they ran. Served by
+# GET /startup and exported as the "startup" stage of the latency histogram.
+_timings = {}
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        _timings[name] = round(seconds * 1000, 1)
+        stage_seconds.observe(seconds, stage="startup", phase=name)
+
+def startup_report():
+    return {"phases_ms": dict(_timings)}
+
+## --------------
+## LAZY PROVIDERS
+## --------------
+# A shared client that is only built (and its library only imported) the first time it is used,
+# so importing the app stays fast and a missing key only fails the requests that need that
+# client. `set` swaps the instance, e.g. for fakes in the benchmarks.
+class Provider:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def created(self):
+        return self._instance is not None
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    with startup_phase(f"provider:{self.name}"):
+                        self._instance = self.factory()
+        return self._instance
+
+    __call__ = get
+
+    def set(self, instance):
+        self._instance = instance
+
+def provider(name):
+    def decorate(factory):
+        return Provider(name, factory)
+    return decorate
@@ -0,0 +1,27 @@
+import asyncio
+
+## --------------
+## SINGLE FLIGHT
+## --------------
+# Concurrent calls with the same key share one execution of `func`. The shared task is
+# shielded, so a caller which gets cancelled (e.g. client disconnect) does not cancel the work
+# for the other callers waiting on it.
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def running(self, key):
+        return key in self._inflight
+
+    async def do(self, key, func):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        return await asyncio.shield(task)